@@ -4,8 +4,14 @@ Policy Search Module
 Provides search functionality for Columbia University policy documents.
 """
 
+import functools
+import heapq
 import json
 import re
+import sys
+import threading
+from bisect import bisect_right
+from operator import itemgetter
 from pathlib import Path
 from typing import Optional
 
@@ -14,6 +20,31 @@ DOCUMENTS = {}
 CONFLICTS = {}
 RULE_INDEX = {}
 
+# Words for matching: lowercase alphanumerics with inner hyphens/apostrophes, no attached punctuation
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9\-']*")
+
+# Keyword boosts: when a category appears in the query, rules mentioning any of its terms score higher
+KEYWORD_BOOSTS = {
+    'defense': ['defense', 'dissertation defense'],
+    'registration': ['register', 'registration', 'enroll'],
+    'opt': ['opt', 'optional practical training'],
+    'prospectus': ['prospectus', 'proposal'],
+    'deadline': ['deadline', 'due'],
+    'international': ['international', 'f-1', 'j-1', 'visa'],
+    'algorithm': ['algorithm', 'algorithms', 'algo'],
+    'prerequisite': ['prerequisite', 'prereq', 'pre-requisite'],
+    'course': ['course', 'courses', 'class', 'classes'],
+}
+ALL_BOOST_TERMS = frozenset(term for terms in KEYWORD_BOOSTS.values() for term in terms)
+
+# Capture content between [RULE:...] and [/RULE], allowing optional
+# whitespace (including newlines) before [/RULE]
+RULE_PATTERN = re.compile(r'\[RULE:([^\]]+)\](.*?)\s*\[/RULE\]', re.DOTALL)
+
+# Only remove known metadata tag patterns to avoid accidentally removing bracket content
+METADATA_TAGS = 'REQUIREMENT|EXCEPTION|TIMING|GRADE|APPLIES_TO|RESTRICTION|CONSEQUENCE|OPTION|PROCESS|APPROVAL|AUTHORITY|RESPONSIBILITY|WORKLOAD|TYPICAL|LIMITATION|PREREQUISITE|SEQUENCE|PURPOSE|COMPONENTS|DOCUMENT-STRUCTURE|PAGE-LIMIT|FORMAT|REQUIRED-SECTIONS|COMMITMENT|NOTIFICATION|CONTENT|FUNDING|ELIGIBILITY|APPROVALS|TYPE|DURATION|OUTCOME|EXCLUSION|RATIONALE|CONDITION|CONFLICT-RESOLUTION|OVERRIDE|APPROVAL_PROCESS|AUTO-APPROVED|AVAILABILITY|RESOURCE|CONFLICT-NOTE|EXCEPTION_STATUS|PREFERENCE|EXPECTATION|OBLIGATION|INFORMATION|CONFLICT_RESOLUTION|POLICY-DATE|DETERMINES|AUTHORITY_DELEGATION|RATIONALE_SPECIFIC|TIMING_NOTE|PURPOSE_SPECIFIC|EXCEPTION_CONDITION|NOTE|SEE-ALSO|APPLIES_TO_SPECIFIC|JURISDICTION|PRECEDENCE'
+METADATA_PATTERN = re.compile(r'\[(' + METADATA_TAGS + r')[^\]]*\]')
+
 
 class PolicySearch:
     """Handles policy document searching and rule retrieval."""
@@ -21,36 +52,186 @@ class PolicySearch:
     def __init__(self, documents: dict, conflicts: dict):
         self.documents = documents
         self.conflicts = conflicts
+        self.build_conflict_index()
         self.build_rule_index()
     
+    def build_conflict_index(self):
+        """Map each uppercased rule ID to the positions of the conflicts it appears in."""
+        self._rule_to_conflicts = {}
+        for i, conflict in enumerate(self.conflicts.get('conflicts', [])):
+            for rule in conflict['rules']:
+                positions = self._rule_to_conflicts.setdefault(rule['rule_id'].upper(), [])
+                if not positions or positions[-1] != i:
+                    positions.append(i)
+    
     def build_rule_index(self):
         """Build index of all rules for fast lookup."""
         for doc_name, content in self.documents.items():
+            # Clean content - remove metadata tags like [TIMING:...], [REQUIREMENT:...], etc.
+            # but preserve the actual rule text. Done once per document rather than per rule;
+            # RULE markers are not metadata tags, so rule boundaries are unaffected.
+            clean_document = METADATA_PATTERN.sub('', content)
+            
             # Extract all rules with their IDs - capture content between [RULE:...] and [/RULE]
-            # Allow optional whitespace (including newlines) before [/RULE]
-            rule_pattern = r'\[RULE:([^\]]+)\](.*?)\s*\[/RULE\]'
-            matches = re.finditer(rule_pattern, content, re.DOTALL)
+            matches = RULE_PATTERN.finditer(clean_document)
             
             for match in matches:
-                rule_id = match.group(1)
-                rule_content = match.group(2).strip()
-                
-                # Clean content - remove metadata tags like [TIMING:...], [REQUIREMENT:...], etc.
-                # but preserve the actual rule text
-                # Only remove known metadata tag patterns to avoid accidentally removing bracket content
-                metadata_tags = 'REQUIREMENT|EXCEPTION|TIMING|GRADE|APPLIES_TO|RESTRICTION|CONSEQUENCE|OPTION|PROCESS|APPROVAL|AUTHORITY|RESPONSIBILITY|WORKLOAD|TYPICAL|LIMITATION|PREREQUISITE|SEQUENCE|PURPOSE|COMPONENTS|DOCUMENT-STRUCTURE|PAGE-LIMIT|FORMAT|REQUIRED-SECTIONS|COMMITMENT|NOTIFICATION|CONTENT|FUNDING|ELIGIBILITY|APPROVALS|TYPE|DURATION|OUTCOME|EXCLUSION|RATIONALE|CONDITION|CONFLICT-RESOLUTION|OVERRIDE|APPROVAL_PROCESS|AUTO-APPROVED|AVAILABILITY|RESOURCE|CONFLICT-NOTE|EXCEPTION_STATUS|PREFERENCE|EXPECTATION|OBLIGATION|INFORMATION|CONFLICT_RESOLUTION|POLICY-DATE|DETERMINES|AUTHORITY_DELEGATION|RATIONALE_SPECIFIC|TIMING_NOTE|PURPOSE_SPECIFIC|EXCEPTION_CONDITION|NOTE|SEE-ALSO|APPLIES_TO_SPECIFIC|JURISDICTION|PRECEDENCE'
-                metadata_pattern = r'\[(' + metadata_tags + r')[^\]]*\]'
-                clean_content = re.sub(metadata_pattern, '', rule_content)
-                clean_content = clean_content.strip()
+                rule_id = sys.intern(match.group(1))
+                clean_content = match.group(2).strip()
                 
                 RULE_INDEX[rule_id] = {
                     'id': rule_id,
                     'content': clean_content,
-                    'document': doc_name,
-                    'full_block': match.group(0)
+                    'document': doc_name
                 }
+        
+        self.build_search_index()
+    
+    def build_search_index(self):
+        """Build inverted indexes used to narrow search to candidate rules."""
+        # Derived from RULE_INDEX as it is now; kept per instance so building another
+        # PolicySearch (which adds to RULE_INDEX) never changes this one's view
+        self._rule_index_upper = {}  # uppercased rule ID -> rule (first match wins), for case-insensitive lookup
+        self._token_index = {}       # content token -> set of rule IDs containing it
+        self._component_index = {}   # lowercased rule ID component -> set of rule IDs
+        self._rules_by_dept = {}     # uppercased department prefix (before ':') -> set of rule IDs
+        
+        # Per-rule search data, kept apart from RULE_INDEX so get_rule output stays unchanged
+        self._content_lower = {}     # rule ID -> lowercased content
+        self._rule_words = {}        # rule ID -> frozenset of lowercased content words
+        self._rule_components = {}   # rule ID -> lowercased ID components longer than 3 chars
+        self._rule_previews = {}     # rule ID -> first 300 chars of content shown in search results
+        self._rule_boost_terms = {}  # rule ID -> frozenset of boost terms its content contains
+        self._boost_term_rules = {}  # boost term -> set of rule IDs whose content contains it
+        
+        self._rule_ids = list(RULE_INDEX)
+        self._rule_order = {rule_id: i for i, rule_id in enumerate(self._rule_ids)}
+        
+        # All lowercased rule contents joined into one string, so substring checks
+        # (phrase match, keyword boosts) are a single scan instead of one per rule
+        corpus_parts = []
+        self._corpus_starts = []
+        position = 0
+        
+        for rule_id, rule_data in RULE_INDEX.items():
+            self._rule_index_upper.setdefault(rule_id.upper(), rule_data)
+            
+            content_lower = rule_data['content'].lower()
+            content_words = frozenset(map(sys.intern, TOKEN_RE.findall(content_lower)))
+            self._content_lower[rule_id] = content_lower
+            self._rule_words[rule_id] = content_words
+            
+            content = rule_data['content']
+            self._rule_previews[rule_id] = content[:300] + ('...' if len(content) > 300 else '')
+            
+            for word in content_words:
+                self._token_index.setdefault(word, set()).add(rule_id)
+            
+            self._rules_by_dept.setdefault(rule_id.split(':', 1)[0].upper(), set()).add(rule_id)
+            
+            # Rule ID components, e.g. ("algo", "prereq") from "PhD_SEAS:ALGO-PREREQ-001";
+            # numbers and very short components are skipped
+            components = tuple(component.lower() for component in rule_id.split(':')[-1].split('-')
+                               if len(component) > 3)
+            self._rule_components[rule_id] = components
+            for component_lower in components:
+                self._component_index.setdefault(component_lower, set()).add(rule_id)
+            
+            self._corpus_starts.append(position)
+            corpus_parts.append(content_lower)
+            position += len(content_lower) + 1
+        
+        self._corpus_lower = '\0'.join(corpus_parts)
+        
+        # Scores depend only on the index, so repeat queries are memoized until the next rebuild
+        self._top_rules = functools.lru_cache(maxsize=256)(self._score_rules)
+        
+        # Keyword boost terms are substring matches, resolved once per term
+        rule_terms = {rule_id: [] for rule_id in self._rule_ids}
+        for term in ALL_BOOST_TERMS:
+            self._boost_term_rules[term] = self._rules_containing(term)
+            for rule_id in self._boost_term_rules[term]:
+                rule_terms[rule_id].append(term)
+        for rule_id, terms in rule_terms.items():
+            self._rule_boost_terms[rule_id] = frozenset(terms)
+    
+    def _rules_containing(self, text: str) -> set:
+        """Return IDs of rules whose lowercased content contains text."""
+        if not text:
+            return set(self._rule_ids)
+        if '\0' in text:
+            return set()
+        
+        found = set()
+        corpus = self._corpus_lower
+        starts = self._corpus_starts
+        pos = corpus.find(text)
+        while pos != -1:
+            idx = bisect_right(starts, pos) - 1
+            found.add(self._rule_ids[idx])
+            # Skip the rest of this rule, it only needs to be found once
+            if idx + 1 >= len(starts):
+                break
+            pos = corpus.find(text, starts[idx + 1])
+        return found
+    
+    def _department_rules(self, department: str) -> set:
+        """Return IDs of rules whose ID starts with department (case-insensitive)."""
+        department_upper = department.upper()
+        if ':' in department_upper:
+            # Prefix reaches past the department name, e.g. 'GSAS:DEFENSE'
+            return {rule_id for rule_id in self._rule_ids if rule_id.upper().startswith(department_upper)}
+        
+        rule_ids = set()
+        for dept, dept_rule_ids in self._rules_by_dept.items():
+            if dept.startswith(department_upper):
+                rule_ids |= dept_rule_ids
+        return rule_ids
+    
+    def _component_scores(self, query_words: set) -> dict:
+        """Score each rule ID component against the query words; only matching components are kept."""
+        long_words = [word for word in query_words if len(word) > 3]  # Skip very short query words
+        if not long_words:
+            return {}
+        
+        scores = {}
+        for component in self._component_index:
+            score = 0
+            for word in long_words:
+                # Exact match or substring match
+                if component in word or word in component:
+                    score += 20  # Very strong boost for rule ID component matches
+                # Partial match (e.g., "algo" matches "algorithm")
+                elif component[:4] == word[:4]:
+                    score += 15
+            if score:
+                scores[component] = score
+        return scores
     
-    def search(self, query: str, department: Optional[str] = None, max_results: int = 5) -> list:
+    def _candidate_rules(self, query_lower: str, query_words: set, component_scores: dict,
+                         active_terms: frozenset) -> set:
+        """Collect IDs of every rule that can score above zero for the query."""
+        candidates = set()
+        
+        # Word matches
+        for word in query_words:
+            candidates.update(self._token_index.get(word, ()))
+        
+        # Exact phrase match
+        candidates.update(self._rules_containing(query_lower))
+        
+        # Keyword boosts
+        for term in active_terms:
+            candidates.update(self._boost_term_rules[term])
+        
+        # Rule ID component matches
+        for component in component_scores:
+            candidates.update(self._component_index[component])
+        
+        return candidates
+    
+    def search(self, query: str, department: Optional[str] = None, max_results: int = 5,
+               include_full: bool = False) -> list:
         """
         Search policies using keyword matching.
         
@@ -58,21 +239,51 @@ class PolicySearch:
             query: Search query
             department: Filter by department (GSAS, ISSO, PhD_SEAS)
             max_results: Maximum number of results to return
+            include_full: Also return each rule's full text (otherwise use get_rule)
         
         Returns:
             List of matching rules with scores
         """
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
+        department_upper = department.upper() if department else None
         
+        # Pick top results by score, then build result dicts only for those
         results = []
+        for score, rule_id in self._top_rules(query.lower(), department_upper, max_results):
+            rule_data = RULE_INDEX[rule_id]
+            result = {
+                'rule_id': rule_id,
+                'content': self._rule_previews[rule_id],
+                'document': rule_data['document'],
+                'score': score
+            }
+            if include_full:
+                result['full_content'] = rule_data['content']
+            results.append(result)
         
-        for rule_id, rule_data in RULE_INDEX.items():
-            # Filter by department if specified (case-insensitive)
-            if department and not rule_id.upper().startswith(department.upper()):
-                continue
-            
-            content_lower = rule_data['content'].lower()
+        return results
+    
+    def _score_rules(self, query_lower: str, department_upper: Optional[str], max_results: int) -> tuple:
+        """Score rules against a normalized query and return the top (score, rule_id) pairs."""
+        query_words = set(TOKEN_RE.findall(query_lower))
+        
+        # Rule ID component boosts depend only on the query, so score each distinct component once
+        component_scores = self._component_scores(query_words)
+        
+        # Boost terms depend only on the query, so resolve them once
+        active_terms = frozenset(term for category, terms in KEYWORD_BOOSTS.items()
+                                 if category in query_lower for term in terms)
+        
+        scored = []
+        
+        # Only score rules that share something with the query
+        candidates = self._candidate_rules(query_lower, query_words, component_scores, active_terms)
+        
+        # Filter by department if specified (case-insensitive)
+        if department_upper:
+            candidates &= self._department_rules(department_upper)
+        
+        for rule_id in sorted(candidates, key=self._rule_order.__getitem__):
+            content_lower = self._content_lower[rule_id]
             
             # Calculate relevance score
             score = 0
@@ -82,63 +293,21 @@ class PolicySearch:
                 score += 10
             
             # Word matches
-            content_words = set(content_lower.split())
-            matching_words = query_words & content_words
+            matching_words = query_words & self._rule_words[rule_id]
             score += len(matching_words) * 2
             
             # Keyword boosts
-            keywords = {
-                'defense': ['defense', 'dissertation defense'],
-                'registration': ['register', 'registration', 'enroll'],
-                'opt': ['opt', 'optional practical training'],
-                'prospectus': ['prospectus', 'proposal'],
-                'deadline': ['deadline', 'due'],
-                'international': ['international', 'f-1', 'j-1', 'visa'],
-                'algorithm': ['algorithm', 'algorithms', 'algo'],
-                'prerequisite': ['prerequisite', 'prereq', 'pre-requisite'],
-                'course': ['course', 'courses', 'class', 'classes'],
-            }
-            
-            for category, terms in keywords.items():
-                if category in query_lower:
-                    for term in terms:
-                        if term in content_lower:
-                            score += 3
+            score += len(self._rule_boost_terms[rule_id] & active_terms) * 3
             
-            # Boost score if rule ID matches query keywords  
-            # Extract rule ID components (e.g., "ALGO-PREREQ" from "PhD_SEAS:ALGO-PREREQ-001")
-            rule_id_lower = rule_id.lower()
-            rule_components = rule_id.split(':')[-1].split('-')  # Get ["ALGO", "PREREQ", "001"]
-            
-            for component in rule_components:
-                component_lower = component.lower()
-                if len(component_lower) <= 3:  # Skip numbers and very short components
-                    continue
-                    
-                # Check if any query word is related to this component
-                for word in query_words:
-                    if len(word) <= 3:  # Skip very short query words
-                        continue
-                    
-                    # Exact match or substring match
-                    if component_lower in word or word in component_lower:
-                        score += 20  # Very strong boost for rule ID component matches
-                    # Partial match (e.g., "algo" matches "algorithm")
-                    elif component_lower[:4] == word[:4] and len(word) >= 4:
-                        score += 15
+            # Boost score if rule ID matches query keywords
+            for component_lower in self._rule_components[rule_id]:
+                score += component_scores.get(component_lower, 0)
             
             if score > 0:
-                results.append({
-                    'rule_id': rule_id,
-                    'content': rule_data['content'][:300] + ('...' if len(rule_data['content']) > 300 else ''),
-                    'full_content': rule_data['content'],
-                    'document': rule_data['document'],
-                    'score': score
-                })
-        
-        # Sort by score and return top results
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results[:max_results]
+                scored.append((score, rule_id))
+        
+        # Ties keep index order
+        return tuple(heapq.nlargest(max_results, scored, key=itemgetter(0)))
     
     def get_rule(self, rule_id: str) -> Optional[dict]:
         """Get a specific rule by ID (case-insensitive)."""
@@ -151,34 +320,24 @@ class PolicySearch:
         if normalized_id in RULE_INDEX:
             return RULE_INDEX[normalized_id]
         
-        # Fall back to case-insensitive search with normalized ID
-        normalized_id_upper = normalized_id.upper()
-        for stored_id, rule_data in RULE_INDEX.items():
-            if stored_id.upper() == normalized_id_upper:
-                return rule_data
+        # Fall back to case-insensitive lookup with normalized ID
+        rule_data = self._rule_index_upper.get(normalized_id.upper())
+        if rule_data is not None:
+            return rule_data
         
-        # Also try case-insensitive search on original rule_id (in case it has unusual format)
-        rule_id_upper = rule_id.upper()
-        for stored_id, rule_data in RULE_INDEX.items():
-            if stored_id.upper() == rule_id_upper:
-                return rule_data
-        
-        return None
+        # Also try case-insensitive lookup on original rule_id (in case it has unusual format)
+        return self._rule_index_upper.get(rule_id.upper())
     
     def check_conflicts(self, rule_ids: list) -> list:
         """Check if any of the given rules have conflicts (case-insensitive)."""
-        conflicts_found = []
-        
         # Normalize input rule IDs to uppercase for comparison
-        rule_ids_upper = [rid.upper() for rid in rule_ids]
+        positions = set()
+        for rid in rule_ids:
+            positions.update(self._rule_to_conflicts.get(rid.upper(), ()))
         
-        for conflict in self.conflicts.get('conflicts', []):
-            conflict_rule_ids = [r['rule_id'] for r in conflict['rules']]
-            conflict_rule_ids_upper = [rid.upper() for rid in conflict_rule_ids]
-            
-            # Check if any of the input rule_ids are in this conflict (case-insensitive)
-            if any(rid in conflict_rule_ids_upper for rid in rule_ids_upper):
-                conflicts_found.append(conflict)
+        # Keep conflicts in their original order
+        all_conflicts = self.conflicts.get('conflicts', [])
+        conflicts_found = [all_conflicts[i] for i in sorted(positions)]
         
         return conflicts_found
 
@@ -194,7 +353,7 @@ def load_documents():
         doc_path = docs_dir / doc_file
         if doc_path.exists():
             with open(doc_path, 'r', encoding='utf-8') as f:
-                doc_name = doc_file.replace('.txt', '').upper()
+                doc_name = sys.intern(doc_file.replace('.txt', '').upper())
                 DOCUMENTS[doc_name] = f.read()
     
     # Load conflicts
@@ -202,3 +361,27 @@ def load_documents():
     if conflicts_path.exists():
         with open(conflicts_path, 'r', encoding='utf-8') as f:
             CONFLICTS = json.load(f)
+
+
+SEARCH = None
+SEARCH_LOCK = threading.Lock()  # Only one thread loads documents and builds the indexes
+
+
+def get_search() -> PolicySearch:
+    """Load documents on first use and return the shared PolicySearch instance."""
+    global SEARCH
+    if SEARCH is None:
+        with SEARCH_LOCK:
+            # Another thread may have built it while we waited for the lock
+            if SEARCH is None:
+                if not DOCUMENTS:
+                    load_documents()
+                SEARCH = PolicySearch(DOCUMENTS, CONFLICTS)
+    return SEARCH
+
+
+def reset_search():
+    """Drop the shared instance so the next get_search() builds a fresh one."""
+    global SEARCH
+    with SEARCH_LOCK:
+        SEARCH = None
@@ -4,11 +4,84 @@ Conflict Extraction Script
 Extracts explicit conflict annotations from policy documents.
 """
 
+import argparse
 import json
 import re
+import sys
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Any
 
+try:
+    import orjson  # Optional: much faster JSON serialization
+except ImportError:
+    orjson = None
+
+# Precompiled patterns shared by every parse
+_JURIS_RE = re.compile(r'\[JURISDICTION:(\w+)\]')
+_PRECED_RE = re.compile(r'\[PRECEDENCE:(\d+)-(\w+)\]')
+_RULE_RE = re.compile(r'\[RULE:([^\]]+)\](.*?)(?=\[RULE:|$)', re.DOTALL)
+# RULE markers, [TAG:value] and bare [TAG] blocks in one alternation
+_CLEAN_RE = re.compile(r'\[/?RULE[^\]]*\]|\[[A-Z-]+(?::[^\]]+)?\]')
+TAG_NAMES = ('CONFLICT-NOTE', 'CONFLICT-CHECK', 'SEE-ALSO', 'OVERRIDE', 'CONFLICT-RESOLUTION')
+# All conflict-related tags in one alternation so each rule is scanned once
+_ALL_TAGS_RE = re.compile(r'\[(?P<name>' + '|'.join(TAG_NAMES) + r'):(?P<val>[^\]]+)\]')
+
+def parse_policy_file(filepath: Path) -> Dict[str, Any]:
+    """Parse a single policy document into its header info and rules.
+    
+    Depends only on the file contents, so documents can be parsed in worker processes.
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    # Extract jurisdiction info from the document header
+    jurisdiction_match = _JURIS_RE.search(content)
+    precedence_match = _PRECED_RE.search(content)
+    
+    jurisdiction = jurisdiction_match.group(1) if jurisdiction_match else "UNKNOWN"
+    precedence = precedence_match.group(1) if precedence_match else "0"
+    precedence_name = precedence_match.group(2) if precedence_match else "Unknown"
+    
+    doc_info = {
+        "filepath": str(filepath),
+        "jurisdiction": jurisdiction,
+        "precedence": int(precedence),
+        "precedence_name": precedence_name,
+        "rules": []
+    }
+    
+    # Find all RULE blocks and remember where each rule body starts and ends
+    rule_spans = [(m.group(1), m.start(2), m.end(2)) for m in _RULE_RE.finditer(content)]
+    rule_starts = [start for _, start, _ in rule_spans]
+    rule_tags = [{name: [] for name in TAG_NAMES} for _ in rule_spans]
+    
+    # Collect conflict annotations for all rules in one sweep over the document
+    for tag_match in _ALL_TAGS_RE.finditer(content):
+        idx = bisect_right(rule_starts, tag_match.start()) - 1
+        if idx < 0 or tag_match.end() > rule_spans[idx][2]:
+            continue  # document header, or a tag straddling two rules
+        rule_tags[idx][tag_match.group('name')].append(tag_match.group('val'))
+    
+    for (rule_id, start, end), tags in zip(rule_spans, rule_tags):
+        # Extract rule metadata and conflict annotations
+        doc_info["rules"].append({
+            "rule_id": rule_id,
+            "jurisdiction": jurisdiction,
+            "precedence": int(precedence),
+            "content": _CLEAN_RE.sub('', content[start:end]).strip(),
+            "conflict_notes": tags['CONFLICT-NOTE'],
+            "conflict_checks": tags['CONFLICT-CHECK'],
+            "see_also": tags['SEE-ALSO'],
+            "override": tags['OVERRIDE'],
+            "conflict_resolution": tags['CONFLICT-RESOLUTION'],
+        })
+    
+    return doc_info
+
+
 class ConflictExtractor:
     def __init__(self, docs_dir: str = "documents"):
         self.docs_dir = Path(docs_dir)
@@ -17,48 +90,15 @@ class ConflictExtractor:
         
     def parse_document(self, filepath: Path) -> Dict[str, Any]:
         """Parse a single policy document and extract rules with conflicts."""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Extract jurisdiction info from the document header
-        jurisdiction_match = re.search(r'\[JURISDICTION:(\w+)\]', content)
-        precedence_match = re.search(r'\[PRECEDENCE:(\d+)-(\w+)\]', content)
-        
-        jurisdiction = jurisdiction_match.group(1) if jurisdiction_match else "UNKNOWN"
-        precedence = precedence_match.group(1) if precedence_match else "0"
-        precedence_name = precedence_match.group(2) if precedence_match else "Unknown"
-        
-        doc_info = {
-            "filepath": str(filepath),
-            "jurisdiction": jurisdiction,
-            "precedence": int(precedence),
-            "precedence_name": precedence_name,
-            "rules": []
-        }
-        
-        # Find all RULE blocks
-        rule_pattern = r'\[RULE:([^\]]+)\](.*?)(?=\[RULE:|$)'
-        rules = re.finditer(rule_pattern, content, re.DOTALL)
-        
-        for rule_match in rules:
-            rule_id = rule_match.group(1)
-            rule_content = rule_match.group(2)
-            
-            # Extract rule metadata and conflict annotations
-            rule_data = {
-                "rule_id": rule_id,
-                "jurisdiction": jurisdiction,
-                "precedence": int(precedence),
-                "content": self._extract_rule_text(rule_content),
-                "conflict_notes": self._extract_tags(rule_content, 'CONFLICT-NOTE'),
-                "conflict_checks": self._extract_tags(rule_content, 'CONFLICT-CHECK'),
-                "see_also": self._extract_tags(rule_content, 'SEE-ALSO'),
-                "override": self._extract_tags(rule_content, 'OVERRIDE'),
-                "conflict_resolution": self._extract_tags(rule_content, 'CONFLICT-RESOLUTION'),
-            }
-            
+        doc_info = parse_policy_file(filepath)
+        self._register_rules(doc_info)
+        return doc_info
+    
+    def _register_rules(self, doc_info: Dict[str, Any]):
+        """Add a parsed document's rules to the rules database and conflicts list."""
+        for rule_data in doc_info["rules"]:
             # Store in rules database
-            self.rules_db[rule_id] = rule_data
+            self.rules_db[rule_data["rule_id"]] = rule_data
             
             # If rule has any conflict-related annotations, add to conflicts list
             if (rule_data['conflict_notes'] or 
@@ -69,35 +109,31 @@ class ConflictExtractor:
                  any('conflict' in tag.lower() for tag in rule_data['conflict_notes'] + rule_data['conflict_checks']))):
                 
                 self.conflicts.append(rule_data)
-            
-            doc_info["rules"].append(rule_data)
-        
-        return doc_info
     
-    def _extract_rule_text(self, content: str) -> str:
-        """Extract the main rule text, excluding metadata tags."""
-        # Remove all [TAG:...] blocks
-        text = re.sub(r'\[/?RULE[^\]]*\]', '', content)
-        text = re.sub(r'\[[A-Z-]+:[^\]]+\]', '', text)
-        text = re.sub(r'\[[A-Z-]+\]', '', text)
-        return text.strip()
-    
-    def _extract_tags(self, content: str, tag_name: str) -> List[str]:
-        """Extract all instances of a specific tag type."""
-        pattern = rf'\[{tag_name}:([^\]]+)\]'
-        matches = re.findall(pattern, content)
-        return matches
-    
-    def process_all_documents(self) -> Dict[str, Any]:
-        """Process all documents in the documents directory."""
+    def process_all_documents(self, workers: int = 1) -> Dict[str, Any]:
+        """Process all documents in the documents directory.
+        
+        With workers > 1, documents are parsed in parallel worker processes.
+        """
         documents = []
+        doc_files = sorted(self.docs_dir.glob("*.txt"))
         
-        # Process each document
-        for doc_file in sorted(self.docs_dir.glob("*.txt")):
-            print(f"Processing {doc_file.name}...")
-            doc_data = self.parse_document(doc_file)
-            documents.append(doc_data)
-            print(f"  Found {len(doc_data['rules'])} rules")
+        if workers > 1 and len(doc_files) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = executor.map(parse_policy_file, doc_files)
+                # Merge in file order so rule and conflict ordering matches a serial run
+                for doc_file, doc_data in zip(doc_files, parsed):
+                    print(f"Processing {doc_file.name}...")
+                    self._register_rules(doc_data)
+                    documents.append(doc_data)
+                    print(f"  Found {len(doc_data['rules'])} rules")
+        else:
+            # Process each document
+            for doc_file in doc_files:
+                print(f"Processing {doc_file.name}...")
+                doc_data = self.parse_document(doc_file)
+                documents.append(doc_data)
+                print(f"  Found {len(doc_data['rules'])} rules")
         
         # Organize conflicts
         organized_conflicts = self._organize_conflicts()
@@ -137,35 +173,44 @@ class ConflictExtractor:
     
     def _count_by_jurisdiction(self) -> Dict[str, int]:
         """Count conflicts by jurisdiction."""
-        counts = {}
-        for conflict in self.conflicts:
-            jurisdiction = conflict["jurisdiction"]
-            counts[jurisdiction] = counts.get(jurisdiction, 0) + 1
-        return counts
+        return dict(Counter(conflict["jurisdiction"] for conflict in self.conflicts))
     
-    def save_results(self, output_file: str = "conflicts.json"):
+    def save_results(self, output_file: str = "conflicts.json", workers: int = 1):
         """Save extracted conflicts to JSON file."""
-        results = self.process_all_documents()
+        results = self.process_all_documents(workers)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        if orjson:
+            with open(output_file, 'wb') as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
         
-        print(f"\n{'='*60}")
-        print(f"Results saved to {output_file}")
-        print(f"{'='*60}")
-        print(f"Total rules parsed: {results['summary']['total_rules']}")
-        print(f"Rules with conflict annotations: {results['summary']['total_conflicts']}")
-        print(f"\nConflicts by jurisdiction:")
-        for jurisdiction, count in results['summary']['conflicts_by_jurisdiction'].items():
-            print(f"  {jurisdiction}: {count}")
-        print(f"{'='*60}")
+        # Build the report once and write it in a single call
+        lines = [
+            f"\n{'='*60}",
+            f"Results saved to {output_file}",
+            f"{'='*60}",
+            f"Total rules parsed: {results['summary']['total_rules']}",
+            f"Rules with conflict annotations: {results['summary']['total_conflicts']}",
+            f"\nConflicts by jurisdiction:",
+        ]
+        lines.extend(f"  {jurisdiction}: {count}"
+                     for jurisdiction, count in results['summary']['conflicts_by_jurisdiction'].items())
+        lines.append(f"{'='*60}")
+        sys.stdout.write("\n".join(lines) + "\n")
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract explicit conflict annotations from policy documents.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parse documents in this many worker processes (default: 1, serial)")
+    args = parser.parse_args()
+    
     print("Policy Conflict Extraction Tool")
     print("="*60)
     
     extractor = ConflictExtractor()
-    extractor.save_results()
+    extractor.save_results(workers=args.workers)
     
     print("\nExtraction complete!")
     print("Review 'conflicts.json' for all extracted conflicts.")
@@ -1,9 +1,14 @@
-with open('documents/phd_seas.txt', 'r', encoding='utf-8') as f:
-    content = f.read()
+import re
+from pathlib import Path
 
-normalized = content.replace('  ', ' ')
+# Any run of two or more spaces, collapsed in a single pass
+MULTI_SPACE = re.compile(r' {2,}')
 
-with open('documents/phd_seas.txt', 'w', encoding='utf-8') as f:
-    f.write(normalized)
+doc_path = Path('documents/phd_seas.txt')
+content = doc_path.read_text(encoding='utf-8')
 
-print("Successfully normalized double spaces to single spaces")
+normalized = MULTI_SPACE.sub(' ', content)
+
+doc_path.write_text(normalized, encoding='utf-8')
+
+print("Successfully normalized repeated spaces to single spaces")
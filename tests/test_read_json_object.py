@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Test the streaming JSON reader used by the transcript analyzer"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+# Add webapp to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "webapp"))
+
+from app import read_json_object
+
+failures = []
+
+
+def check(name, ok, detail=""):
+    print(f"{'✓' if ok else '✗'} {name}" + (f" ({detail})" if detail and not ok else ""))
+    if not ok:
+        failures.append(name)
+
+
+def split_at(text, cuts):
+    """Split text into chunks at the given sorted positions."""
+    bounds = [0, *cuts, len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def read_all_splits(text, expected, name):
+    """Check every two-chunk split, single characters and random splits of text."""
+    splits = [[text], list(text)]
+    splits += [split_at(text, [i]) for i in range(1, len(text))]
+    rng = random.Random(0)
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, min(10, len(text) - 1))))
+        splits.append(split_at(text, cuts))
+
+    bad = []
+    for chunks in splits:
+        result, parsed = read_json_object(iter(chunks))
+        if parsed != expected or not text.startswith(result):
+            bad.append(chunks)
+    check(f"{name}: {len(splits)} chunk splits", not bad, f"first failing split: {bad[:1]}")
+
+
+print("=" * 60)
+print("STREAMING JSON READER TEST")
+print("=" * 60)
+
+analysis = {
+    "courses": [{"name": "Algorithms", "grade": "A", "reasoning": "Meets {all} checks"}],
+    "summary": {"total": 1, "eligible": 1}
+}
+read_all_splits("Here is the analysis:\n" + json.dumps(analysis) + "\nLet me know!", analysis,
+                "object between surrounding text")
+
+tricky = {
+    "quote": 'He said "use {braces}" here',
+    "backslash": "ends with a backslash \\",
+    "mixed": '\\"}{\\',
+    "unicode": "naïve — 签证",
+    "nested": {"list": [{"a": "}"}, {"b": "{"}], "empty": {}}
+}
+read_all_splits(json.dumps(tricky), tricky, "escaped quotes and braces inside strings")
+read_all_splits(json.dumps(tricky, ensure_ascii=False), tricky, "non-ASCII text left unescaped")
+
+print("\n" + "-" * 60)
+
+# Only the first top-level object is parsed
+result, parsed = read_json_object(iter(['{"a": 1}', ' {"b": 2}']))
+check("stops at the first complete object", parsed == {"a": 1}, parsed)
+
+# The stream is left unread once the object closes
+remaining = iter(['{"a": ', '1}', ' trailing', ' text'])
+result, parsed = read_json_object(remaining)
+check("leaves the rest of the stream unread", list(remaining) == [' trailing', ' text'], result)
+
+# Invalid JSON inside balanced braces: whole stream is returned, nothing parsed
+result, parsed = read_json_object(iter(['{not json}', ' more', ' text']))
+check("invalid object returns None with all text", parsed is None and result == '{not json} more text',
+      (result, parsed))
+
+# No object at all
+result, parsed = read_json_object(iter(['no json', ' here']))
+check("text without an object returns None", parsed is None and result == 'no json here', (result, parsed))
+
+# Truncated object (stream ends before it closes)
+result, parsed = read_json_object(iter(['{"a": {"b": 1}', ', "c": "}']))
+check("unterminated object returns None", parsed is None and result == '{"a": {"b": 1}, "c": "}',
+      (result, parsed))
+
+print("\n" + "=" * 60)
+if failures:
+    print(f"✗ {len(failures)} check(s) failed")
+    sys.exit(1)
+print("✓ All streaming JSON reader tests passed!")
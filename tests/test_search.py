@@ -21,12 +21,12 @@ if len(RULE_INDEX) == 0:
     
     # Test the regex pattern
     content = DOCUMENTS.get('PHD_SEAS', '')
-    pattern = r'\[RULE:([^\]]+)\](.*?)(?=\[RULE:|$)'
+    pattern = re.compile(r'\[RULE:([^\]]+)\](.*?)(?=\[RULE:|$)', re.DOTALL)
     
     print(f"\nDocument length: {len(content)} chars")
     print(f"Sample content: {content[:300]}")
     
-    matches = list(re.finditer(pattern, content, re.DOTALL))
+    matches = list(pattern.finditer(content))
     print(f"\nRegex pattern found: {len(matches)} matches")
     
     if matches:
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Test search tokenization and ranking in policy_server"""
+
+import sys
+from pathlib import Path
+
+# Add policy_server to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "policy_server"))
+
+from server import PolicySearch, TOKEN_RE, get_search
+
+failures = []
+
+
+def check(name, ok, detail=""):
+    print(f"{'✓' if ok else '✗'} {name}" + (f" ({detail})" if detail and not ok else ""))
+    if not ok:
+        failures.append(name)
+
+
+def ranking(search, query, **kwargs):
+    return [(r['rule_id'], r['score']) for r in search.search(query, **kwargs)]
+
+
+print("=" * 60)
+print("TOKENIZER TEST")
+print("=" * 60)
+
+check("punctuation is not attached to words",
+      TOKEN_RE.findall("defense, deadline. (visa)") == ["defense", "deadline", "visa"])
+check("hyphenated terms stay one token", TOKEN_RE.findall("f-1 and j-1") == ["f-1", "and", "j-1"])
+check("apostrophes stay inside words", TOKEN_RE.findall("student's plan") == ["student's", "plan"])
+
+# Built before the real documents are loaded, so only these rules are indexed.
+# Short ID components (A, B, ...) get no rule ID boost, so scores come from the text
+SAMPLE_DOCUMENTS = {
+    'SAMPLE': (
+        "[RULE:SAMPLE:A-001]The defenses and deadlines page.[/RULE]\n"
+        "[RULE:SAMPLE:B-001]Schedule your defense, then meet the deadline.[/RULE]\n"
+        "[RULE:SAMPLE:C-001]F-1 students keep their status.[/RULE]\n"
+        "[RULE:SAMPLE:D-001]Section 1 f status form.[/RULE]\n"
+    )
+}
+sample = PolicySearch(SAMPLE_DOCUMENTS, {})
+
+print("\n" + "=" * 60)
+print("RANKING TEST - sample rules")
+print("=" * 60)
+
+# Both rules get the same keyword boosts; only the tokenized word matches separate them
+results = ranking(sample, "deadline defense")
+print(f"'deadline defense' → {results}")
+check("words followed by punctuation match query words",
+      results[:2] == [("SAMPLE:B-001", 10), ("SAMPLE:A-001", 6)], results)
+
+results_punct = ranking(sample, "Deadline defense?")
+check("punctuation in the query doesn't change ranking", results_punct == results, results_punct)
+
+# 'f-1' must not match the separate words 'f' and '1'
+results = ranking(sample, "f-1 status")
+print(f"'f-1 status' → {results}")
+check("hyphenated query term matches only the hyphenated word",
+      results == [("SAMPLE:C-001", 4), ("SAMPLE:D-001", 2)], results)
+
+print("\n" + "=" * 60)
+print("RANKING TEST - policy documents")
+print("=" * 60)
+
+search = get_search()
+for query, expected in [
+    ("algorithms prerequisite", "PhD_SEAS:ALGO-PREREQ"),
+    ("visa, OPT.", "ISSO:"),
+    ("f-1 visa", "ISSO:"),
+]:
+    results = ranking(search, query, max_results=3)
+    print(f"'{query}' → {[rule_id for rule_id, _ in results]}")
+    check(f"top result for '{query}' is {expected}*",
+          bool(results) and results[0][0].startswith(expected), results)
+
+# Building another PolicySearch must not break an existing one
+check("earlier instance still searches after a new one is built",
+      ranking(sample, "deadline defense")[:2] == [("SAMPLE:B-001", 10), ("SAMPLE:A-001", 6)])
+
+print("\n" + "=" * 60)
+if failures:
+    print(f"✗ {len(failures)} check(s) failed")
+    sys.exit(1)
+print("✓ All tokenizer and ranking tests passed!")
@@ -6,18 +6,42 @@ Simple Flask app that connects to MCP server and Claude API
 
 import os
 import json
+import atexit
+import functools
+import queue
+import re
+import sqlite3
+import sys
+import threading
 import asyncio
 import subprocess
+from collections import OrderedDict, defaultdict
 from pathlib import Path
 from datetime import datetime, timedelta
-import hashlib
+import time
 import uuid
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
 from anthropic import Anthropic
 import logging
 from dotenv import load_dotenv
 import gspread
 
+try:
+    import orjson  # Optional: faster JSON serialization of tool results
+except ImportError:
+    orjson = None
+
+import xxhash
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer  # Optional: semantic cache
+except ImportError:
+    SentenceTransformer = None
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -28,20 +52,114 @@ logger = logging.getLogger(__name__)
 # Cache configuration
 CACHE_ENABLED = True
 CACHE_TTL = timedelta(hours=24)  # Cache for 24 hours
+CACHE_TTL_SECONDS = CACHE_TTL.total_seconds()
 MAX_CACHE_SIZE = 1000  # Maximum number of cached queries
+CACHE_KEY_HASH_THRESHOLD = 512  # Queries this long or longer are hashed into a key
 
-# Cache storage
-QUERY_CACHE = {}
-cache_hits = 0
-cache_misses = 0
+# Batch configuration
+BATCH_MAX_ITERATIONS = 15  # Tool-use rounds per batched query
+BATCH_QUERY_TIMEOUT_SECONDS = 600  # Time budget per batched query, counted from when it starts running
+BATCH_POOL = ThreadPoolExecutor(max_workers=8)  # Answers a batch's queries concurrently
+
+# Uploaded files are hashed in chunks and sent to the Files API as raw bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_POOL = ThreadPoolExecutor(max_workers=8)  # Hashes/uploads a request's files in parallel
+FILES_API_BETA = "files-api-2025-04-14"
+
+# Independent tool calls from one model turn run concurrently
+TOOL_POOL = ThreadPoolExecutor(max_workers=8)
+
+# Cache storage (least recently used first)
+QUERY_CACHE = OrderedDict()
+CACHE_LOCK = threading.Lock()  # Guards QUERY_CACHE and the semantic cache rows
+
+
+class AtomicCounter:
+    """Thread-safe counter: an int guarded by its own small lock."""
+    
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+    
+    def increment(self):
+        with self._lock:
+            self._value += 1
+    
+    @property
+    def value(self):
+        return self._value
+
+
+# Cache statistics
+CACHE_HITS = AtomicCounter()
+CACHE_MISSES = AtomicCounter()
+
+# Persistent cache store (survives restarts and deploys)
+CACHE_DB_ENABLED = True
+CACHE_DB_PATH = Path(__file__).parent / 'cache.db'
+CACHE_DB_QUEUE = queue.Queue()  # (sql, params) writes (or flush Events) for the background writer
+CACHE_DB_FLUSH_TIMEOUT = 10  # Seconds clear_cache waits for the writer
+CACHE_DB_PRUNE_INTERVAL = 3600  # Seconds between deletes of expired rows
+CACHE_DB_MAX_ROWS = 10 * MAX_CACHE_SIZE  # Newest rows kept on disk
+CACHE_DB_LOCK = threading.Lock()  # Guards the shared read connection
+cache_db = None
+cache_db_writer_thread = None
+
+# Semantic cache (near-duplicate queries reuse a cached response). Off unless
+# SEMANTIC_CACHE=1: near-identical wording can ask about different facts
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE", "").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.95  # Minimum cosine similarity for a hit
+SEMANTIC_TERM_RE = re.compile(r"\w+")
+SEMANTIC_STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "can", "could",
+    "what", "which", "how", "when", "where", "who", "why", "i", "my", "me", "we", "our", "you",
+    "of", "for", "to", "in", "on", "at", "by", "with", "about", "and", "or", "it", "this", "that",
+    "there", "any", "please", "tell"
+})
+embedding_model = None
+CACHE_EMBEDDINGS = None  # [N, 384] unit-length query embeddings
+CACHE_EMBEDDING_KEYS = []  # QUERY_CACHE key for each embedding row
+
+# Small talk answered without calling Claude
+TRIVIAL_WORD_RE = re.compile(r"[\w']+")  # Unicode words, so non-Latin queries are never "punctuation only"
+GREETING_QUERIES = frozenset({
+    "hi", "hello", "hey", "hiya", "yo", "greetings", "hi there", "hello there", "hey there",
+    "good morning", "good afternoon", "good evening"
+})
+# Bare acknowledgements ("ok", "great") are left out: mid-conversation they can
+# be the answer to a clarifying question
+THANKS_QUERIES = frozenset({
+    "thanks", "thank you", "thx", "ty", "thanks a lot", "thank you so much", "thanks so much",
+    "ok thanks", "ok thank you", "great thanks", "cool thanks", "bye", "goodbye"
+})
+GREETING_RESPONSE = (
+    "Hi! I can answer questions about Columbia GSAS, ISSO and SEAS PhD policies. "
+    "Ask me about a rule, a requirement or your situation."
+)
+THANKS_RESPONSE = "You're welcome! Let me know if you have another policy question."
 
 # Conversation storage
-CONVERSATIONS = {}  # session_id: [messages]
+CONVERSATIONS = OrderedDict()  # session_id: [messages] in Claude API shape, least recently active first
+CONVERSATION_ACTIVITY = {}  # session_id: time.time() of the last message
+CONVERSATIONS_LOCK = threading.Lock()  # Guards adding, reordering and removing sessions
+SESSION_LOCKS = defaultdict(threading.Lock)  # session_id: lock guarding that session's message list
+MAX_CONVERSATION_MESSAGES = 20  # Messages kept per session
+MAX_SESSIONS = 5000  # Hard ceiling; least recently active sessions are dropped first
+CONVERSATION_TTL_SECONDS = 24 * 3600  # Sessions idle longer than this are reaped
+CONVERSATION_REAP_INTERVAL = 300  # Seconds between reaper passes
 
 # Google Sheets logging
 SHEET_ID = os.environ.get("GOOGLE_SHEET_ID", "")
 SHEETS_ENABLED = True
+SHEETS_BATCH_SIZE = 50  # Max rows per append_rows call
+SHEETS_FLUSH_INTERVAL = 5  # Seconds to wait for more rows before writing a batch
+SHEETS_QUEUE_SIZE = 1000  # Rows buffered before new log rows are dropped
+SHEETS_QUEUE = queue.Queue(maxsize=SHEETS_QUEUE_SIZE)  # Rows waiting for the background writer
+SHEETS_FEEDBACK_POOL = ThreadPoolExecutor(max_workers=1)  # Writes feedback rows off the request path
 sheets_client = None
+log_sheet = None  # Worksheet that query logs are appended to
+sheets_writer_thread = None
 
 def init_google_sheets():
     """Initialize Google Sheets client."""
@@ -53,14 +171,14 @@ def init_google_sheets():
             credentials_dict = json.loads(google_creds)
             sheets_client = gspread.service_account_from_dict(credentials_dict)
             logger.info("✓ Google Sheets logging enabled (from environment variable)")
-            return True
+            return start_sheets_writer()
         
         # Fall back to credentials.json file (for local development)
         credentials_path = Path(__file__).parent / 'credentials.json'
         if credentials_path.exists():
             sheets_client = gspread.service_account(filename=str(credentials_path))
             logger.info("✓ Google Sheets logging enabled (from credentials file)")
-            return True
+            return start_sheets_writer()
         
         logger.warning("No Google credentials found - Google Sheets logging disabled")
         SHEETS_ENABLED = False
@@ -71,19 +189,63 @@ def init_google_sheets():
         SHEETS_ENABLED = False
         return False
 
+def start_sheets_writer():
+    """Resolve the log worksheet once and start the background writer."""
+    global log_sheet, sheets_writer_thread
+    log_sheet = sheets_client.open_by_key(SHEET_ID).sheet1
+    
+    if sheets_writer_thread is None:
+        sheets_writer_thread = threading.Thread(target=sheets_writer, name="sheets-writer", daemon=True)
+        sheets_writer_thread.start()
+        atexit.register(stop_sheets_writer)
+    return True
+
+
+def sheets_writer():
+    """Background thread: batch queued rows into append_rows calls."""
+    while True:
+        row = SHEETS_QUEUE.get()
+        rows = []
+        deadline = time.monotonic() + SHEETS_FLUSH_INTERVAL
+        
+        # Collect rows until the batch is full, the interval passes or we're stopped
+        while row is not None:
+            rows.append(row)
+            if len(rows) >= SHEETS_BATCH_SIZE:
+                break
+            try:
+                row = SHEETS_QUEUE.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        
+        if rows:
+            try:
+                log_sheet.append_rows(rows, value_input_option='RAW', insert_data_option='INSERT_ROWS')
+                logger.info(f"✓ Logged {len(rows)} row(s) to Google Sheets")
+            except Exception as e:
+                logger.error(f"Failed to log to Google Sheets: {e}")
+        
+        if row is None:
+            return
+
+
+def stop_sheets_writer():
+    """Flush queued rows before the process exits."""
+    if sheets_writer_thread and sheets_writer_thread.is_alive():
+        SHEETS_QUEUE.put(None)
+        sheets_writer_thread.join(timeout=30)
+
+
 def log_to_sheets(session_id, query, response, tool_uses, iterations, cached):
-    """Log query and response to Google Sheets."""
-    if not SHEETS_ENABLED or not sheets_client:
+    """Queue a query/response row for the Google Sheets writer."""
+    if not SHEETS_ENABLED or not log_sheet:
         return
     
+    # Format tool uses as comma-separated names
+    tool_names = ', '.join([t['name'] for t in tool_uses]) if tool_uses else 'None'
+    
     try:
-        sheet = sheets_client.open_by_key(SHEET_ID).sheet1
-        
-        # Format tool uses as comma-separated names
-        tool_names = ', '.join([t['name'] for t in tool_uses]) if tool_uses else 'None'
-        
-        # Append row to sheet
-        sheet.append_row([
+        SHEETS_QUEUE.put_nowait([
             datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             session_id,
             query,
@@ -92,10 +254,9 @@ def log_to_sheets(session_id, query, response, tool_uses, iterations, cached):
             iterations,
             'Yes' if cached else 'No'
         ])
-        
-        logger.info("✓ Logged to Google Sheets")
-    except Exception as e:
-        logger.error(f"Failed to log to Google Sheets: {e}")
+    except queue.Full:
+        # Never block a request on Sheets - drop the row if the writer is behind
+        logger.warning("Google Sheets queue full, dropping log row")
 
 
 def log_feedback_to_sheets(feedback_data):
@@ -151,6 +312,34 @@ def log_feedback_to_sheets(feedback_data):
         # Don't raise exception - let the response go through even if sheets logging fails
 app = Flask(__name__, static_folder='static', static_url_path='')
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (jsonify and request.json)."""
+    
+    def options(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding and re-encoding
+        option = self.options() | orjson.OPT_APPEND_NEWLINE
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype)
+
+
+if orjson:
+    app.json = ORJSONProvider(app)
+
 # Initialize Anthropic client
 client = None
 try:
@@ -158,30 +347,40 @@ try:
 except Exception as e:
     logger.error(f"Failed to initialize Anthropic client: {e}")
 
+CLIENT_READY = client is not None
+CLIENT_NOT_CONFIGURED_BODY = b'{"error":"Anthropic API key not configured"}'
+
+
+def client_not_configured():
+    """Static 503 served in place of a route that needs the Anthropic client."""
+    return Response(CLIENT_NOT_CONFIGURED_BODY, status=503, mimetype='application/json')
+
 # Pre-load MCP server components at startup
 MCP_LOADED = False
 SEARCH_ENGINE = None
+TOOL_DISPATCH = {}  # tool name: handler(tool_input), built by init_mcp_server
 
 
 def init_mcp_server():
     """Initialize MCP server components at startup."""
-    global MCP_LOADED, SEARCH_ENGINE
+    global MCP_LOADED, SEARCH_ENGINE, TOOL_DISPATCH
     try:
         server_path = Path(__file__).parent.parent / "policy_server" / "server.py"
         import sys
         sys.path.insert(0, str(server_path.parent))
         
-        from server import PolicySearch, DOCUMENTS, CONFLICTS, load_documents, RULE_INDEX
+        from server import DOCUMENTS, get_search, reset_search, RULE_INDEX
         
-        # Load documents
-        load_documents()
+        # Load documents and build the shared search engine (built only once per process)
+        search_engine = get_search()
         
         if not DOCUMENTS:
+            reset_search()
             logger.error("Failed to load policy documents!")
             return False
         
-        # Create search engine
-        SEARCH_ENGINE = PolicySearch(DOCUMENTS, CONFLICTS)
+        SEARCH_ENGINE = search_engine
+        TOOL_DISPATCH = build_tool_dispatch(search_engine, search_engine.conflicts)
         MCP_LOADED = True
         
         logger.info(f"✓ MCP Server initialized: {len(DOCUMENTS)} documents loaded")
@@ -216,6 +415,10 @@ MCP_TOOLS = [
                 "max_results": {
                     "type": "number",
                     "description": "Maximum number of results (default: 5)",
+                },
+                "include_full": {
+                    "type": "boolean",
+                    "description": "Include the full text of each matching rule (default: false; use get_rule for a single rule)"
                 }
             },
             "required": ["query"]
@@ -256,196 +459,743 @@ MCP_TOOLS = [
         "input_schema": {
             "type": "object",
             "properties": {}
-        }
+        },
+        # Cache breakpoint on the last tool: the tool list is cached as a prompt prefix
+        "cache_control": {"type": "ephemeral"}
     }
 ]
 
+# System prompt (built once, shared by the query, stream and batch endpoints)
+SYSTEM_PROMPT = """You are a Columbia University policy advisor assistant.
+
+CRITICAL: DO NOT MAKE ASSUMPTIONS
+
+When evaluating approvals, signatures, or requirements:
+- NEVER assume someone's role from their name alone
+- NEVER assume one signature fulfills multiple requirements
+- If signature/approval requirements exist, verify ALL are present
+- If information about WHO signed/approved is ambiguous, EXPLICITLY state: "The information doesn't specify whether [person] is the [role1] or [role2]. Clarification needed on [person]'s role."
+- When multiple signatures/approvals required from different roles, verify EACH role separately
+
+Example of what NOT to do:
+❌ "Cliff signed the import request" → assuming Cliff is the advisor
+✓ "Cliff signed, but it's unclear whether Cliff is the student's advisor or the algorithms instructor. Both signatures are required from two different people."
+
+ADAPTIVE RESPONSE:
+
+For DIRECT QUESTIONS:
+- Direct answer
+- Use [1], [2], [3] citation format for rules (list at end)
+- Include contacts if available
+- Concise
+
+For SITUATIONS:
+- Identify affected areas
+- Search comprehensively
+- Structured response:
+  **Situation**
+  **Affected Areas** (enrollment, visa, housing, financial aid, ER, M&F, etc.)
+  **Requirements** [citations]
+  **Action Plan** (with contacts)
+  **Options**
+  **Warnings**
+  **Contacts**
+
+CRITICAL: Always check Extended Residence (ER) and Matriculation & Facilities (M&F) options in planning scenarios.
+
+RESEARCH:
+- Search ALL related areas (enrollment, visa, housing, financial aid, ER, M&F, etc.)
+- Check conflicts when multiple policies apply
+- Extract contacts - emailids, phone numbers, office locations
+- If information is missing or unclear: explicitly state "Documentation does not cover [topic]" or "Insufficient information available on [topic]"
+
+OUTPUT:
+- Use [1], [2] citation format (list all citations at end as "Citations: [1] RULE-ID, [2] RULE-ID")
+- Flag missing information clearly
+- Highlight ER/M&F when relevant
+- Be concise and avoid repetition
+- Under 1500 words
+- Verified reasoning only (no false starts)"""
+
+# System blocks with a cache breakpoint, so the tools + system prefix is reused
+# across tool-use iterations and across queries within the cache TTL
+SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+
+def build_tool_dispatch(search_engine, conflicts_data):
+    """Build the tool name -> handler table over a loaded search engine."""
+    
+    def search_policies(tool_input):
+        query = tool_input.get("query")
+        department = tool_input.get("department")
+        max_results = tool_input.get("max_results", 5)
+        include_full = tool_input.get("include_full", False)
+        
+        logger.info(f"  🔍 Searching for: '{query}' (department: {department}, max: {max_results})")
+        
+        results = search_engine.search(query, department, max_results, include_full)
+        result_rule_ids = [r['rule_id'] for r in results]
+        conflicts = search_engine.check_conflicts(result_rule_ids)
+        
+        logger.info(f"  ✅ Found {len(results)} results: {result_rule_ids[:3]}...")
+        if results:
+            logger.info(f"  📋 Top result: {results[0]['rule_id']} (score: {results[0]['score']})")
+        
+        return {
+            "query": query,
+            "results_count": len(results),
+            "results": results,
+            "conflicts_detected": len(conflicts) > 0,
+            "conflicts": conflicts if conflicts else None
+        }
+    
+    def get_rule(tool_input):
+        rule_id = tool_input.get("rule_id")
+        rule = search_engine.get_rule(rule_id)
+        
+        if not rule:
+            return {"error": f"Rule {rule_id} not found"}
+        
+        conflicts = search_engine.check_conflicts([rule_id])
+        return {
+            "rule": rule,
+            "conflicts": conflicts if conflicts else None
+        }
+    
+    def check_conflicts(tool_input):
+        rule_ids = tool_input.get("rule_ids", [])
+        conflicts = search_engine.check_conflicts(rule_ids)
+        
+        return {
+            "rule_ids_checked": rule_ids,
+            "conflicts_found": len(conflicts),
+            "conflicts": conflicts
+        }
+    
+    def get_precedence_framework(tool_input):
+        return conflicts_data.get('precedence_framework', {})
+    
+    return {
+        "search_policies": search_policies,
+        "get_rule": get_rule,
+        "check_conflicts": check_conflicts,
+        "get_precedence_framework": get_precedence_framework
+    }
+
 
 def call_mcp_tool(tool_name: str, tool_input: dict) -> dict:
     """
     Call MCP server tool using pre-loaded search engine.
     """
-    global SEARCH_ENGINE
-    
     try:
         # Use pre-loaded search engine or initialize if needed
-        if not SEARCH_ENGINE:
+        if not TOOL_DISPATCH:
             logger.warning("Search engine not initialized, initializing now...")
             if not init_mcp_server():
                 return {"error": "Failed to initialize MCP server"}
         
-        search_engine = SEARCH_ENGINE
-        
-        # Get CONFLICTS for precedence framework
-        from server import CONFLICTS
-        
-        # Call the appropriate tool
-        if tool_name == "search_policies":
-            query = tool_input.get("query")
-            department = tool_input.get("department")
-            max_results = tool_input.get("max_results", 5)
-            
-            logger.info(f"  🔍 Searching for: '{query}' (department: {department}, max: {max_results})")
-            
-            results = search_engine.search(query, department, max_results)
-            result_rule_ids = [r['rule_id'] for r in results]
-            conflicts = search_engine.check_conflicts(result_rule_ids)
-            
-            logger.info(f"  ✅ Found {len(results)} results: {result_rule_ids[:3]}...")
-            if results:
-                logger.info(f"  📋 Top result: {results[0]['rule_id']} (score: {results[0]['score']})")
-            
-            return {
-                "query": query,
-                "results_count": len(results),
-                "results": results,
-                "conflicts_detected": len(conflicts) > 0,
-                "conflicts": conflicts if conflicts else None
-            }
-        
-        elif tool_name == "get_rule":
-            rule_id = tool_input.get("rule_id")
-            rule = search_engine.get_rule(rule_id)
-            
-            if not rule:
-                return {"error": f"Rule {rule_id} not found"}
-            
-            conflicts = search_engine.check_conflicts([rule_id])
-            return {
-                "rule": rule,
-                "conflicts": conflicts if conflicts else None
-            }
-        
-        elif tool_name == "check_conflicts":
-            rule_ids = tool_input.get("rule_ids", [])
-            conflicts = search_engine.check_conflicts(rule_ids)
-            
-            return {
-                "rule_ids_checked": rule_ids,
-                "conflicts_found": len(conflicts),
-                "conflicts": conflicts
-            }
-        
-        elif tool_name == "get_precedence_framework":
-            return CONFLICTS.get('precedence_framework', {})
-        
-        return {"error": "Unknown tool"}
+        handler = TOOL_DISPATCH.get(tool_name)
+        if handler is None:
+            return {"error": "Unknown tool"}
+        return handler(tool_input)
         
     except Exception as e:
         logger.error(f"Error calling MCP tool: {e}")
         return {"error": str(e)}
 
 
+def dumps_json(obj) -> str:
+    """Serialize to a JSON string, with orjson when it is installed."""
+    if orjson:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def loads_json(s):
+    """Parse a JSON string (or bytes), with orjson when it is installed."""
+    if orjson:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+class ToolError(Exception):
+    """An error result from call_mcp_tool, raised so lru_cache doesn't keep it."""
+
+
+@functools.lru_cache(maxsize=2048)
+def call_mcp_tool_cached(tool_name: str, input_key: str) -> str:
+    """Serialized tool result for a canonical (sorted-key JSON) tool input."""
+    result = call_mcp_tool(tool_name, loads_json(input_key))
+    if "error" in result:
+        raise ToolError(result)
+    return dumps_json(result)
+
+
+def call_mcp_tool_json(tool_name: str, tool_input: dict) -> str:
+    """Call an MCP tool and serialize its result (runs on TOOL_POOL)."""
+    if not TOOL_DISPATCH:
+        # Don't memoize results produced before the search engine is loaded
+        return dumps_json(call_mcp_tool(tool_name, tool_input))
+    try:
+        return call_mcp_tool_cached(tool_name, json.dumps(tool_input, sort_keys=True))
+    except ToolError as e:
+        # Errors (including transient ones) are retried on the next call
+        return dumps_json(e.args[0])
+
+
+def run_tool_calls(tool_use_blocks) -> list:
+    """Run a turn's tool calls concurrently and return their tool_result blocks in order."""
+    futures = []
+    for tool_block in tool_use_blocks:
+        logger.info(f"  Calling tool: {tool_block.name}")
+        futures.append(TOOL_POOL.submit(call_mcp_tool_json, tool_block.name, tool_block.input))
+    
+    tool_results = []
+    for tool_block, future in zip(tool_use_blocks, futures):
+        tool_content = future.result()
+        
+        logger.info(f"  ✓ {tool_block.name} returned {len(tool_content)} chars")
+        
+        tool_results.append({
+            "type": "tool_result",
+            "tool_use_id": tool_block.id,
+            "content": tool_content
+        })
+    return tool_results
+
+
 # Cache helper functions
 def get_cache_key(query: str) -> str:
-    """Generate a cache key from query text."""
-    return hashlib.md5(query.lower().strip().encode()).hexdigest()
+    """Generate a cache key from query text (short queries are their own key)."""
+    normalized = query.lower().strip()
+    if len(normalized) < CACHE_KEY_HASH_THRESHOLD:
+        return normalized
+    # Prefixed so a digest can never collide with a short query used as its own key
+    return "h:" + xxhash.xxh3_128_hexdigest(normalized.encode())
 
 
 def get_cached_response(query: str) -> dict:
     """Check if query response is cached and still valid."""
-    global cache_hits, cache_misses
-    
     if not CACHE_ENABLED:
         return None
     
     key = get_cache_key(query)
-    if key in QUERY_CACHE:
-        cached = QUERY_CACHE[key]
-        # Check if cache entry is still valid
-        if datetime.now() - cached['timestamp'] < CACHE_TTL:
-            cache_hits += 1
-            logger.info(f"  ✓ Cache HIT - returning cached response")
-            return cached
+    semantic = False
+    if key not in QUERY_CACHE:
+        row = load_persisted_response(key)
+        if row:
+            embedding = embed_for_cache(row[0])
+            with CACHE_LOCK:
+                hydrate_cache_entry(key, *row, embedding=embedding)
+                evict_lru_entries()
         else:
+            key = find_semantic_match(query)
+            semantic = key is not None
+    
+    with CACHE_LOCK:
+        cached = QUERY_CACHE.get(key)
+        if cached is not None:
+            # Check if cache entry is still valid
+            if time.time() - cached['timestamp'] < CACHE_TTL_SECONDS:
+                QUERY_CACHE.move_to_end(key)
+                CACHE_HITS.increment()
+                if semantic:
+                    logger.info(f"  Semantic match with cached query: {cached['query'][:50]}")
+                logger.info(f"  ✓ Cache HIT - returning cached response")
+                return dict(cached, tool_uses=expand_tool_uses(cached['tool_uses']))
+            
             # Cache expired, remove it
             del QUERY_CACHE[key]
+            remove_cache_embeddings([key])
             logger.info(f"  Cache entry expired, removing")
     
-    cache_misses += 1
+    CACHE_MISSES.increment()
     logger.info(f"  Cache MISS - processing with Claude")
     return None
 
 
 def cache_response(query: str, response: str, tool_uses: list, iterations: int):
-    """Cache a query response."""
+    """Cache a query response, evicting least recently used entries when full."""
     if not CACHE_ENABLED:
         return
     
-    # Check if cache is full and evict oldest entries
-    if len(QUERY_CACHE) >= MAX_CACHE_SIZE:
-        evict_old_entries()
-    
     key = get_cache_key(query)
+    timestamp = time.time()
+    embedding = embed_for_cache(query)  # Model inference stays outside the lock
+    with CACHE_LOCK:
+        QUERY_CACHE[key] = {
+            'response': response,
+            'tool_uses': compact_tool_uses(tool_uses),
+            'iterations': iterations,
+            'timestamp': timestamp,
+            'query': query  # Store original query for debugging
+        }
+        QUERY_CACHE.move_to_end(key)
+        add_cache_embedding(key, embedding)
+        evict_lru_entries()
+    
+    if cache_db is not None:
+        CACHE_DB_QUEUE.put((
+            "INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?, ?, ?)",
+            (key, query, response, json.dumps(tool_uses), iterations, timestamp)
+        ))
+    
+    logger.info(f"  ✓ Response cached (cache size: {len(QUERY_CACHE)})")
+
+
+def compact_tool_uses(tool_uses) -> tuple:
+    """Store tool uses as (interned name, sorted input items) tuples."""
+    return tuple(
+        (sys.intern(tool_use['name']), tuple(sorted(tool_use['input'].items())))
+        for tool_use in tool_uses
+    )
+
+
+def expand_tool_uses(tool_uses) -> list:
+    """Rebuild the {name, input} dicts returned to clients."""
+    return [{"name": name, "input": dict(items)} for name, items in tool_uses]
+
+
+def evict_lru_entries():
+    """Drop least recently used entries beyond MAX_CACHE_SIZE (caller holds CACHE_LOCK)."""
+    evicted = []
+    while len(QUERY_CACHE) > MAX_CACHE_SIZE:
+        evicted.append(QUERY_CACHE.popitem(last=False)[0])
+    if evicted:
+        remove_cache_embeddings(evicted)
+        logger.info(f"  Evicted {len(evicted)} least recently used cache entries")
+
+
+# Persistent cache store helper functions
+def connect_cache_db():
+    """Open a connection to the SQLite cache store."""
+    conn = sqlite3.connect(str(CACHE_DB_PATH), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def cache_cutoff() -> float:
+    """Oldest timestamp that is still within CACHE_TTL."""
+    return time.time() - CACHE_TTL_SECONDS
+
+
+def cache_version() -> str:
+    """Hash of everything a stored answer depends on (prompt, tools and policy corpus)."""
+    parts = [SYSTEM_PROMPT, json.dumps(MCP_TOOLS, sort_keys=True)]
+    if SEARCH_ENGINE is not None:
+        parts.append(json.dumps(SEARCH_ENGINE.documents, sort_keys=True))
+        parts.append(json.dumps(SEARCH_ENGINE.conflicts, sort_keys=True, default=str))
+    return xxhash.xxh3_128_hexdigest("\0".join(parts).encode())
+
+
+def prune_cache_db(conn):
+    """Delete expired rows and everything past the newest CACHE_DB_MAX_ROWS."""
+    conn.execute("DELETE FROM query_cache WHERE ts <= ?", (cache_cutoff(),))
+    conn.execute(
+        "DELETE FROM query_cache WHERE key NOT IN "
+        "(SELECT key FROM query_cache ORDER BY ts DESC LIMIT ?)",
+        (CACHE_DB_MAX_ROWS,)
+    )
+
+
+def init_cache_store():
+    """Open the cache store, warm QUERY_CACHE from it and start the writer."""
+    global cache_db, cache_db_writer_thread, CACHE_DB_ENABLED
+    if not CACHE_ENABLED or not CACHE_DB_ENABLED:
+        return False
+    
+    try:
+        cache_db = connect_cache_db()
+        cache_db.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache "
+            "(key TEXT PRIMARY KEY, query TEXT, response TEXT, tool_uses TEXT, iterations INT, ts REAL)"
+        )
+        cache_db.execute("CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value TEXT)")
+        
+        # Answers from an older prompt, tool set or document corpus are stale
+        version = cache_version()
+        stored = cache_db.execute("SELECT value FROM cache_meta WHERE name = 'version'").fetchone()
+        if stored is None or stored[0] != version:
+            if stored is not None:
+                logger.info("Prompt or policy documents changed; dropping persisted cache entries")
+            cache_db.execute("DELETE FROM query_cache")
+            cache_db.execute("INSERT OR REPLACE INTO cache_meta VALUES ('version', ?)", (version,))
+        
+        prune_cache_db(cache_db)
+        cache_db.commit()
+        
+        # Most recent entries go into memory, oldest first so LRU order matches
+        rows = cache_db.execute(
+            "SELECT key, query, response, tool_uses, iterations, ts FROM query_cache "
+            "ORDER BY ts DESC LIMIT ?",
+            (MAX_CACHE_SIZE,)
+        ).fetchall()
+        rows.reverse()
+        embeddings = [embed_for_cache(row[1]) for row in rows]  # Outside the lock
+        with CACHE_LOCK:
+            for row, embedding in zip(rows, embeddings):
+                hydrate_cache_entry(*row, embedding=embedding)
+        
+        cache_db_writer_thread = threading.Thread(target=cache_db_writer, name="cache-db-writer", daemon=True)
+        cache_db_writer_thread.start()
+        atexit.register(stop_cache_db_writer)
+        
+        logger.info(f"✓ Cache store ready ({len(rows)} entries loaded from {CACHE_DB_PATH.name})")
+        return True
+        
+    except Exception as e:
+        logger.error(f"Failed to open cache store: {e}")
+        CACHE_DB_ENABLED = False
+        cache_db = None
+        return False
+
+
+def load_persisted_response(key: str):
+    """Look up an unexpired entry in the cache store."""
+    if cache_db is None:
+        return None
+    
+    with CACHE_DB_LOCK:
+        return cache_db.execute(
+            "SELECT query, response, tool_uses, iterations, ts FROM query_cache WHERE key = ? AND ts > ?",
+            (key, cache_cutoff())
+        ).fetchone()
+
+
+def hydrate_cache_entry(key, query, response, tool_uses, iterations, ts, embedding=None):
+    """Put a stored entry into QUERY_CACHE (caller holds CACHE_LOCK)."""
     QUERY_CACHE[key] = {
         'response': response,
-        'tool_uses': tool_uses,
+        'tool_uses': compact_tool_uses(loads_json(tool_uses)),
         'iterations': iterations,
-        'timestamp': datetime.now(),
-        'query': query  # Store original query for debugging
+        'timestamp': ts,
+        'query': query
     }
-    logger.info(f"  ✓ Response cached (cache size: {len(QUERY_CACHE)})")
+    QUERY_CACHE.move_to_end(key)
+    add_cache_embedding(key, embedding)
 
 
-def evict_old_entries():
-    """Evict oldest cache entries when cache is full."""
-    # Sort by timestamp and remove oldest 10%
-    sorted_entries = sorted(
-        QUERY_CACHE.items(),
-        key=lambda x: x[1]['timestamp']
-    )
-    num_to_remove = max(1, len(sorted_entries) // 10)
+def cache_db_writer():
+    """Background thread: apply queued writes to the cache store in batches."""
+    conn = connect_cache_db()
+    next_prune = time.monotonic() + CACHE_DB_PRUNE_INTERVAL
+    while True:
+        # Wake up at least once per prune interval even when no writes arrive
+        try:
+            writes = [CACHE_DB_QUEUE.get(timeout=max(0, next_prune - time.monotonic()))]
+        except queue.Empty:
+            writes = []
+        while True:
+            try:
+                writes.append(CACHE_DB_QUEUE.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            with conn:
+                for write in writes:
+                    if write is not None and not isinstance(write, threading.Event):
+                        conn.execute(*write)
+                if time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + CACHE_DB_PRUNE_INTERVAL
+                    prune_cache_db(conn)
+        except Exception as e:
+            logger.error(f"Failed to write to cache store: {e}")
+        
+        # Wake anyone waiting for the writes queued before their marker
+        for write in writes:
+            if isinstance(write, threading.Event):
+                write.set()
+        
+        if None in writes:
+            conn.close()
+            return
+
+
+def flush_cache_db_writer() -> bool:
+    """Block until the writes queued so far are committed."""
+    if not (cache_db_writer_thread and cache_db_writer_thread.is_alive()):
+        return False
+    flushed = threading.Event()
+    CACHE_DB_QUEUE.put(flushed)
+    return flushed.wait(CACHE_DB_FLUSH_TIMEOUT)
+
+
+def stop_cache_db_writer():
+    """Flush queued cache writes before the process exits."""
+    if cache_db_writer_thread and cache_db_writer_thread.is_alive():
+        CACHE_DB_QUEUE.put(None)
+        cache_db_writer_thread.join(timeout=30)
+
+
+# Semantic cache helper functions
+def init_semantic_cache():
+    """Load the embedding model used for semantic cache lookups."""
+    global embedding_model, SEMANTIC_CACHE_ENABLED
+    if not SEMANTIC_CACHE_ENABLED:
+        return False
+    if SentenceTransformer is None:
+        logger.warning("sentence-transformers not installed - semantic cache disabled")
+        SEMANTIC_CACHE_ENABLED = False
+        return False
     
-    for i in range(num_to_remove):
-        key = sorted_entries[i][0]
-        del QUERY_CACHE[key]
+    try:
+        embedding_model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        logger.info("✓ Semantic cache enabled")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to load embedding model: {e}")
+        SEMANTIC_CACHE_ENABLED = False
+        return False
+
+
+@functools.lru_cache(maxsize=256)
+def embed_query(normalized_query: str):
+    """Embed a normalized query as a unit-length [1, 384] row."""
+    return embedding_model.encode([normalized_query], normalize_embeddings=True)
+
+
+def find_semantic_match(query: str):
+    """Return the cache key of the most similar cached query, if close enough."""
+    if not SEMANTIC_CACHE_ENABLED or embedding_model is None or CACHE_EMBEDDINGS is None:
+        return None
     
-    logger.info(f"  Evicted {num_to_remove} old cache entries")
+    query_embedding = embed_query(query.lower().strip())
+    with CACHE_LOCK:
+        if CACHE_EMBEDDINGS is None:
+            return None
+        sims = CACHE_EMBEDDINGS @ query_embedding.T
+        best = int(sims.argmax())
+        if sims[best, 0] <= SEMANTIC_CACHE_THRESHOLD:
+            return None
+        key = CACHE_EMBEDDING_KEYS[best]
+        cached = QUERY_CACHE.get(key)
+        # Similar wording is not enough ("F-1" vs "J-1", "2" vs "3 courses"):
+        # the content words must be the same too
+        if cached is None or query_terms(cached['query']) != query_terms(query):
+            return None
+        return key
+
+
+def query_terms(query: str) -> frozenset:
+    """Lowercased words of a query, without stopwords."""
+    return frozenset(word for word in SEMANTIC_TERM_RE.findall(query.lower()) if word not in SEMANTIC_STOPWORDS)
+
+
+def embed_for_cache(query: str):
+    """Embedding row to store with a cache entry, or None (call outside CACHE_LOCK)."""
+    if not SEMANTIC_CACHE_ENABLED or embedding_model is None:
+        return None
+    return embed_query(query.lower().strip())
+
+
+def add_cache_embedding(key: str, row):
+    """Record a precomputed embedding row for a cached query (caller holds CACHE_LOCK)."""
+    global CACHE_EMBEDDINGS
+    if row is None or key in CACHE_EMBEDDING_KEYS:
+        return
+    
+    CACHE_EMBEDDINGS = row if CACHE_EMBEDDINGS is None else np.vstack([CACHE_EMBEDDINGS, row])
+    CACHE_EMBEDDING_KEYS.append(key)
+
+
+def remove_cache_embeddings(keys):
+    """Drop the embedding rows of removed cache entries (caller holds CACHE_LOCK)."""
+    global CACHE_EMBEDDINGS, CACHE_EMBEDDING_KEYS
+    if CACHE_EMBEDDINGS is None:
+        return
+    
+    keys = set(keys)
+    keep = [i for i, key in enumerate(CACHE_EMBEDDING_KEYS) if key not in keys]
+    if len(keep) == len(CACHE_EMBEDDING_KEYS):
+        return
+    
+    CACHE_EMBEDDING_KEYS = [CACHE_EMBEDDING_KEYS[i] for i in keep]
+    CACHE_EMBEDDINGS = CACHE_EMBEDDINGS[keep] if keep else None
 
 
 # Conversation helper functions
+@functools.lru_cache(maxsize=1024)
+def trivial_response(normalized_query: str):
+    """Canned reply for greetings, thanks and punctuation-only input (None otherwise)."""
+    words = TRIVIAL_WORD_RE.findall(normalized_query)
+    if not words:
+        return GREETING_RESPONSE
+    if len(words) > 3:
+        return None
+    
+    phrase = " ".join(words)
+    if phrase in GREETING_QUERIES:
+        return GREETING_RESPONSE
+    if phrase in THANKS_QUERIES:
+        return THANKS_RESPONSE
+    return None
+
+
 def get_or_create_session(session_id=None):
     """Get existing session or create new one."""
     if not session_id or session_id not in CONVERSATIONS:
         session_id = str(uuid.uuid4())
-        CONVERSATIONS[session_id] = []
+        with CONVERSATIONS_LOCK:
+            CONVERSATIONS[session_id] = []
+            touch_session(session_id)
         logger.info(f"Created new session: {session_id}")
     return session_id
 
 
-def add_to_conversation(session_id, role, content):
-    """Add message to conversation history."""
-    if session_id not in CONVERSATIONS:
-        CONVERSATIONS[session_id] = []
-    
-    CONVERSATIONS[session_id].append({
-        "role": role,
-        "content": content,
-        "timestamp": datetime.now()
-    })
+def touch_session(session_id):
+    """Mark a session as just used and enforce MAX_SESSIONS (caller holds CONVERSATIONS_LOCK)."""
+    CONVERSATION_ACTIVITY[session_id] = time.time()
+    CONVERSATIONS.move_to_end(session_id)
+    while len(CONVERSATIONS) > MAX_SESSIONS:
+        oldest, _ = CONVERSATIONS.popitem(last=False)
+        CONVERSATION_ACTIVITY.pop(oldest, None)
+        SESSION_LOCKS.pop(oldest, None)
 
 
-def get_conversation_history(session_id, max_messages=20):
-    """Get conversation history formatted for Claude API."""
-    if session_id not in CONVERSATIONS:
-        return []
+def add_to_conversation(session_id, role, content):
+    """Add message to conversation history (dropped if the session was cleared or expired)."""
+    # Don't re-create a session that was removed while this request ran
+    with CONVERSATIONS_LOCK:
+        messages = CONVERSATIONS.get(session_id)
+        if messages is None:
+            logger.info(f"Session {session_id} no longer exists; message not saved")
+            return
+        session_lock = SESSION_LOCKS[session_id]
     
-    messages = CONVERSATIONS[session_id]
+    with session_lock:
+        messages.append({"role": role, "content": content})
+        
+        # Truncate in place to avoid context limits
+        if len(messages) > MAX_CONVERSATION_MESSAGES:
+            del messages[:-MAX_CONVERSATION_MESSAGES]
     
-    # Truncate to last max_messages to avoid context limits
-    if len(messages) > max_messages:
-        messages = messages[-max_messages:]
+    with CONVERSATIONS_LOCK:
+        if session_id in CONVERSATIONS:
+            touch_session(session_id)
+
+
+def get_conversation_history(session_id, max_messages=MAX_CONVERSATION_MESSAGES):
+    """Get a copy of the conversation history, formatted for Claude API."""
+    with CONVERSATIONS_LOCK:
+        messages = CONVERSATIONS.get(session_id)
+        if messages is None:
+            return []
+        session_lock = SESSION_LOCKS[session_id]
     
-    # Format for Claude API (only role and content)
-    return [{"role": msg["role"], "content": msg["content"]} 
-            for msg in messages]
+    with session_lock:
+        return messages[-max_messages:]
 
 
 def clear_conversation(session_id):
-    """Clear conversation history."""
-    if session_id in CONVERSATIONS:
+    """Clear conversation history; returns False if there was none."""
+    with CONVERSATIONS_LOCK:
+        if session_id not in CONVERSATIONS:
+            return False
         del CONVERSATIONS[session_id]
-        logger.info(f"Cleared conversation: {session_id}")
+        CONVERSATION_ACTIVITY.pop(session_id, None)
+        SESSION_LOCKS.pop(session_id, None)
+    logger.info(f"Cleared conversation: {session_id}")
+    return True
+
+
+def reap_idle_conversations():
+    """Drop sessions idle longer than CONVERSATION_TTL_SECONDS; returns how many."""
+    cutoff = time.time() - CONVERSATION_TTL_SECONDS
+    reaped = 0
+    with CONVERSATIONS_LOCK:
+        # Sessions are ordered by activity, so stop at the first live one
+        while CONVERSATIONS:
+            session_id = next(iter(CONVERSATIONS))
+            if CONVERSATION_ACTIVITY.get(session_id, 0) > cutoff:
+                break
+            del CONVERSATIONS[session_id]
+            CONVERSATION_ACTIVITY.pop(session_id, None)
+            SESSION_LOCKS.pop(session_id, None)
+            reaped += 1
+    return reaped
+
+
+def conversation_reaper():
+    """Background thread: periodically reap idle conversations."""
+    while True:
+        time.sleep(CONVERSATION_REAP_INTERVAL)
+        reaped = reap_idle_conversations()
+        if reaped:
+            logger.info(f"Reaped {reaped} idle conversation(s) ({len(CONVERSATIONS)} active)")
+
+
+def start_conversation_reaper():
+    """Start the idle-conversation reaper thread."""
+    threading.Thread(target=conversation_reaper, name="conversation-reaper", daemon=True).start()
+
+
+def answer_batch_query(user_query: str) -> dict:
+    """Run the tool loop for one batched query (runs on BATCH_POOL)."""
+    # The budget starts now, not at submission, so time spent queued behind
+    # other queries (or other batch requests) doesn't count against it
+    deadline = time.monotonic() + BATCH_QUERY_TIMEOUT_SECONDS
+    messages = [{"role": "user", "content": user_query}]
+    tool_uses = []
+    
+    for iteration in range(1, BATCH_MAX_ITERATIONS + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"error": "Timed out"}
+        
+        response = client.messages.create(
+            model="claude-sonnet-4-5-20250929",
+            max_tokens=2048,
+            temperature=0,
+            system=SYSTEM_BLOCKS,
+            tools=MCP_TOOLS,
+            messages=messages,
+            timeout=remaining
+        )
+        
+        tool_use_blocks = [block for block in response.content if block.type == "tool_use"]
+        if response.stop_reason == "tool_use" and tool_use_blocks:
+            if time.monotonic() >= deadline:
+                return {"error": "Timed out"}
+            for tool_block in tool_use_blocks:
+                tool_uses.append({
+                    "name": tool_block.name,
+                    "input": tool_block.input
+                })
+            messages.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "user", "content": run_tool_calls(tool_use_blocks)})
+            continue
+        
+        final_response = ""
+        for block in response.content:
+            if hasattr(block, "text"):
+                final_response += block.text
+        
+        return {"response": final_response, "tool_uses": tool_uses, "iterations": iteration}
+    
+    return {"error": "Max iterations reached"}
+
+
+def answer_batch_queries(queries: dict) -> dict:
+    """
+    Answer independent queries concurrently, each with its own tool loop.
+    
+    Takes {custom_id: query}, returns {custom_id: outcome}. Every query is
+    waited for; each one is bounded by its own BATCH_QUERY_TIMEOUT_SECONDS.
+    """
+    futures = {
+        custom_id: BATCH_POOL.submit(answer_batch_query, user_query)
+        for custom_id, user_query in queries.items()
+    }
+    wait(futures.values())
+    
+    outcomes = {}
+    for custom_id, future in futures.items():
+        if future.exception() is not None:
+            outcomes[custom_id] = {"error": str(future.exception())}
+        else:
+            outcomes[custom_id] = future.result()
+    return outcomes
 
 
 @app.route('/')
@@ -475,9 +1225,20 @@ def query():
         
         logger.info(f"Processing query in session {session_id}: {user_query}")
         
+        # Answer small talk directly, without a Claude call
+        canned = trivial_response(user_query.lower().strip())
+        if canned:
+            log_to_sheets(session_id, user_query, canned, [], 0, False)
+            return jsonify({
+                "response": canned,
+                "tool_uses": [],
+                "iterations": 0,
+                "session_id": session_id,
+                "cached": False
+            })
+        
         # Check cache only for first message in conversation
-        conversation_history = get_conversation_history(session_id)
-        if len(conversation_history) == 0:
+        if not CONVERSATIONS.get(session_id):
             cached = get_cached_response(user_query)
             if cached:
                 # Add to conversation history
@@ -494,7 +1255,7 @@ def query():
                     "iterations": cached['iterations'],
                     "cached": True,
                     "session_id": session_id,
-                    "cache_timestamp": cached['timestamp'].isoformat()
+                    "cache_timestamp": datetime.fromtimestamp(cached['timestamp']).isoformat()
                 })
         
         # Add user message to conversation
@@ -518,56 +1279,7 @@ def query():
                 model="claude-sonnet-4-5-20250929",
                 max_tokens=2048,
                 temperature=0,
-                system="""You are a Columbia University policy advisor assistant.
-
-CRITICAL: DO NOT MAKE ASSUMPTIONS
-
-When evaluating approvals, signatures, or requirements:
-- NEVER assume someone's role from their name alone
-- NEVER assume one signature fulfills multiple requirements
-- If signature/approval requirements exist, verify ALL are present
-- If information about WHO signed/approved is ambiguous, EXPLICITLY state: "The information doesn't specify whether [person] is the [role1] or [role2]. Clarification needed on [person]'s role."
-- When multiple signatures/approvals required from different roles, verify EACH role separately
-
-Example of what NOT to do:
-❌ "Cliff signed the import request" → assuming Cliff is the advisor
-✓ "Cliff signed, but it's unclear whether Cliff is the student's advisor or the algorithms instructor. Both signatures are required from two different people."
-
-ADAPTIVE RESPONSE:
-
-For DIRECT QUESTIONS:
-- Direct answer
-- Use [1], [2], [3] citation format for rules (list at end)
-- Include contacts if available
-- Concise
-
-For SITUATIONS:
-- Identify affected areas
-- Search comprehensively
-- Structured response:
-  **Situation**
-  **Affected Areas** (enrollment, visa, housing, financial aid, ER, M&F, etc.)
-  **Requirements** [citations]
-  **Action Plan** (with contacts)
-  **Options**
-  **Warnings**
-  **Contacts**
-
-CRITICAL: Always check Extended Residence (ER) and Matriculation & Facilities (M&F) options in planning scenarios.
-
-RESEARCH:
-- Search ALL related areas (enrollment, visa, housing, financial aid, ER, M&F, etc.)
-- Check conflicts when multiple policies apply
-- Extract contacts - emailids, phone numbers, office locations
-- If information is missing or unclear: explicitly state "Documentation does not cover [topic]" or "Insufficient information available on [topic]"
-
-OUTPUT:
-- Use [1], [2] citation format (list all citations at end as "Citations: [1] RULE-ID, [2] RULE-ID")
-- Flag missing information clearly
-- Highlight ER/M&F when relevant
-- Be concise and avoid repetition
-- Under 1500 words
-- Verified reasoning only (no false starts)""",
+                system=SYSTEM_BLOCKS,
                 tools=MCP_TOOLS,
                 messages=messages
             )
@@ -596,27 +1308,10 @@ OUTPUT:
                         "content": assistant_content
                     })
                     
-                    # Call MCP server for each tool and collect all results
-                    tool_results = []
-                    for tool_block in tool_use_blocks:
-                        logger.info(f"  Calling tool: {tool_block.name}")
-                        tool_result = call_mcp_tool(
-                            tool_block.name,
-                            tool_block.input
-                        )
-                        
-                        logger.info(f"  ✓ {tool_block.name} returned {len(str(tool_result))} chars")
-                        
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": tool_block.id,
-                            "content": json.dumps(tool_result)
-                        })
-                    
-                    # Add all tool results in a single user message
+                    # Call MCP server for all tools and add the results in a single user message
                     messages.append({
                         "role": "user",
-                        "content": tool_results
+                        "content": run_tool_calls(tool_use_blocks)
                     })
                     
                     # Continue loop to get Claude's response with the tool results
@@ -635,7 +1330,7 @@ OUTPUT:
             add_to_conversation(session_id, "assistant", final_response)
             
             # Cache the response (only for first message)
-            if len(get_conversation_history(session_id)) == 2:  # user + assistant
+            if len(CONVERSATIONS.get(session_id, ())) == 2:  # user + assistant
                 cache_response(user_query, final_response, tool_uses, iteration)
             
             # Log to Google Sheets
@@ -666,6 +1361,153 @@ OUTPUT:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/query/stream', methods=['POST'])
+def query_stream():
+    """
+    Handle user query, streaming Claude's output as Server-Sent Events.
+    
+    Each event is a JSON object: "text" deltas, a "tool_use" event when a
+    turn ends in tool calls (text streamed before it was interim), then a
+    final "done" (or "error") event.
+    """
+    if not client:
+        return jsonify({
+            "error": "Anthropic API key not configured. Set ANTHROPIC_API_KEY environment variable."
+        }), 500
+    
+    data = request.json
+    user_query = data.get('query', '')
+    session_id = data.get('session_id')
+    
+    if not user_query:
+        return jsonify({"error": "Query is required"}), 400
+    
+    # Get or create session
+    session_id = get_or_create_session(session_id)
+    
+    logger.info(f"Streaming query in session {session_id}: {user_query}")
+    
+    def event(payload):
+        return f"data: {dumps_json(payload)}\n\n"
+    
+    def generate():
+        try:
+            # Answer small talk directly, without a Claude call
+            canned = trivial_response(user_query.lower().strip())
+            if canned:
+                log_to_sheets(session_id, user_query, canned, [], 0, False)
+                yield event({"type": "text", "text": canned})
+                yield event({
+                    "type": "done",
+                    "tool_uses": [],
+                    "iterations": 0,
+                    "cached": False,
+                    "session_id": session_id
+                })
+                return
+            
+            # Check cache only for first message in conversation
+            if not CONVERSATIONS.get(session_id):
+                cached = get_cached_response(user_query)
+                if cached:
+                    add_to_conversation(session_id, "user", user_query)
+                    add_to_conversation(session_id, "assistant", cached['response'])
+                    log_to_sheets(session_id, user_query, cached['response'], 
+                                cached['tool_uses'], cached['iterations'], True)
+                    
+                    yield event({"type": "text", "text": cached['response']})
+                    yield event({
+                        "type": "done",
+                        "tool_uses": cached['tool_uses'],
+                        "iterations": cached['iterations'],
+                        "cached": True,
+                        "session_id": session_id
+                    })
+                    return
+            
+            add_to_conversation(session_id, "user", user_query)
+            messages = get_conversation_history(session_id)
+            tool_uses = []
+            max_iterations = 15
+            
+            for iteration in range(1, max_iterations + 1):
+                logger.info(f"→ Iteration {iteration}/{max_iterations} (streaming)")
+                
+                with client.messages.stream(
+                    model="claude-sonnet-4-5-20250929",
+                    max_tokens=2048,
+                    temperature=0,
+                    system=SYSTEM_BLOCKS,
+                    tools=MCP_TOOLS,
+                    messages=messages
+                ) as stream:
+                    for text in stream.text_stream:
+                        yield event({"type": "text", "text": text})
+                    response = stream.get_final_message()
+                
+                tool_use_blocks = [block for block in response.content if block.type == "tool_use"]
+                if response.stop_reason == "tool_use" and tool_use_blocks:
+                    for tool_block in tool_use_blocks:
+                        tool_uses.append({
+                            "name": tool_block.name,
+                            "input": tool_block.input
+                        })
+                    yield event({
+                        "type": "tool_use",
+                        "tools": [tool_block.name for tool_block in tool_use_blocks],
+                        "iteration": iteration
+                    })
+                    
+                    messages.append({
+                        "role": "assistant",
+                        "content": response.content
+                    })
+                    messages.append({
+                        "role": "user",
+                        "content": run_tool_calls(tool_use_blocks)
+                    })
+                    continue
+                
+                final_response = ""
+                for block in response.content:
+                    if hasattr(block, "text"):
+                        final_response += block.text
+                
+                logger.info(f"✓ Streamed query completed in {iteration} iteration(s)")
+                
+                add_to_conversation(session_id, "assistant", final_response)
+                if len(CONVERSATIONS.get(session_id, ())) == 2:  # user + assistant
+                    cache_response(user_query, final_response, tool_uses, iteration)
+                log_to_sheets(session_id, user_query, final_response, tool_uses, iteration, False)
+                
+                yield event({
+                    "type": "done",
+                    "tool_uses": tool_uses,
+                    "iterations": iteration,
+                    "cached": False,
+                    "session_id": session_id
+                })
+                return
+            
+            logger.error(f"✗ Max iterations ({max_iterations}) reached without completion")
+            yield event({
+                "type": "error",
+                "error": f"Max iterations ({max_iterations}) reached. The query was too complex or encountered an error.",
+                "tool_uses": tool_uses,
+                "iterations": max_iterations
+            })
+            
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            yield event({"type": "error", "error": str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route('/api/batch', methods=['POST'])
 def batch_query():
     """Handle batch queries - process multiple independent queries."""
@@ -691,163 +1533,63 @@ def batch_query():
         successful = 0
         failed = 0
         
-        # Process each query independently
+        # Answer cached queries directly; everything else is answered concurrently
+        pending = {}
         for idx, user_query in enumerate(queries):
-            logger.info(f"Processing batch query {idx + 1}/{len(queries)}: {user_query[:50]}...")
+            cached = get_cached_response(user_query)
+            if cached:
+                # Log cached response to Google Sheets
+                log_to_sheets('batch', user_query, cached['response'], 
+                            cached['tool_uses'], cached['iterations'], True)
+                
+                results.append({
+                    "query_index": idx + 1,
+                    "query": user_query,
+                    "response": cached['response'],
+                    "tool_uses": cached['tool_uses'],
+                    "iterations": cached['iterations'],
+                    "cached": True
+                })
+                successful += 1
+            else:
+                pending[f"q{idx}"] = (idx, user_query)
+                results.append(None)
+        
+        if pending:
+            logger.info(f"Answering {len(pending)} uncached queries concurrently")
+            outcomes = answer_batch_queries(
+                {custom_id: user_query for custom_id, (_, user_query) in pending.items()}
+            )
             
-            try:
-                # Check cache first
-                cached = get_cached_response(user_query)
-                if cached:
-                    # Log cached response to Google Sheets
-                    log_to_sheets('batch', user_query, cached['response'], 
-                                cached['tool_uses'], cached['iterations'], True)
-                    
-                    results.append({
+            for custom_id, (idx, user_query) in pending.items():
+                outcome = outcomes.get(custom_id, {"error": "No result returned"})
+                if "error" in outcome:
+                    logger.error(f"Batch query {idx + 1} failed: {outcome['error']}")
+                    results[idx] = {
                         "query_index": idx + 1,
                         "query": user_query,
-                        "response": cached['response'],
-                        "tool_uses": cached['tool_uses'],
-                        "iterations": cached['iterations'],
-                        "cached": True
-                    })
-                    successful += 1
+                        "error": outcome["error"],
+                        "cached": False
+                    }
+                    failed += 1
                     continue
                 
-                # Process new query (no conversation context for batch)
-                messages = [{"role": "user", "content": user_query}]
-                tool_uses = []
-                max_iterations = 15
-                iteration = 0
+                # Cache the response
+                cache_response(user_query, outcome["response"], outcome["tool_uses"], outcome["iterations"])
                 
-                while iteration < max_iterations:
-                    iteration += 1
-                    
-                    response = client.messages.create(
-                        model="claude-sonnet-4-5-20250929",
-                        max_tokens=2048,
-                        temperature=0,
-                        system="""You are a Columbia University policy advisor assistant.
-
-ADAPTIVE RESPONSE:
-
-For DIRECT QUESTIONS:
-- Direct answer
-- Use [1], [2], [3] citation format for rules (list at end)
-- Include contacts if available
-- Concise
-
-For SITUATIONS:
-- Identify affected areas
-- Search comprehensively
-- Structured response:
-  **Situation**
-  **Affected Areas** (enrollment, visa, housing, financial aid, ER, M&F, etc.)
-  **Requirements** [citations]
-  **Action Plan** (with contacts)
-  **Options**
-  **Warnings**
-  **Contacts**
-
-CRITICAL: Always check Extended Residence (ER) and Matriculation & Facilities (M&F) options in planning scenarios.
-
-RESEARCH:
-- Search ALL related areas (enrollment, visa, housing, financial aid, ER, M&F, etc.)
-- Check conflicts when multiple policies apply
-- Extract contacts - emailids, phone numbers, office locations
-- If information is missing or unclear: explicitly state "Documentation does not cover [topic]" or "Insufficient information available on [topic]"
-
-OUTPUT:
-- Use [1], [2] citation format (list all citations at end as "Citations: [1] RULE-ID, [2] RULE-ID")
-- Flag missing information clearly
-- Highlight ER/M&F when relevant
-- Be concise and avoid repetition
-- Under 1500 words
-- Verified reasoning only (no false starts)""",
-                        tools=MCP_TOOLS,
-                        messages=messages
-                    )
-                    
-                    if response.stop_reason == "tool_use":
-                        tool_use_blocks = []
-                        assistant_content = []
-                        
-                        for block in response.content:
-                            if block.type == "tool_use":
-                                tool_use_blocks.append(block)
-                                tool_uses.append({
-                                    "name": block.name,
-                                    "input": block.input
-                                })
-                            assistant_content.append(block)
-                        
-                        if tool_use_blocks:
-                            messages.append({
-                                "role": "assistant",
-                                "content": assistant_content
-                            })
-                            
-                            tool_results = []
-                            for tool_block in tool_use_blocks:
-                                tool_result = call_mcp_tool(
-                                    tool_block.name,
-                                    tool_block.input
-                                )
-                                
-                                tool_results.append({
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_block.id,
-                                    "content": json.dumps(tool_result)
-                                })
-                            
-                            messages.append({
-                                "role": "user",
-                                "content": tool_results
-                            })
-                            continue
-                    
-                    # Extract final response
-                    final_response = ""
-                    for block in response.content:
-                        if hasattr(block, "text"):
-                            final_response += block.text
-                    
-                    # Cache the response
-                    cache_response(user_query, final_response, tool_uses, iteration)
-                    
-                    # Log to Google Sheets
-                    log_to_sheets('batch', user_query, final_response, tool_uses, iteration, False)
-                    
-                    results.append({
-                        "query_index": idx + 1,
-                        "query": user_query,
-                        "response": final_response,
-                        "tool_uses": tool_uses,
-                        "iterations": iteration,
-                        "cached": False
-                    })
-                    successful += 1
-                    break
+                # Log to Google Sheets
+                log_to_sheets('batch', user_query, outcome["response"], outcome["tool_uses"],
+                            outcome["iterations"], False)
                 
-                if iteration >= max_iterations:
-                    logger.error(f"Batch query {idx + 1} reached max iterations")
-                    results.append({
-                        "query_index": idx + 1,
-                        "query": user_query,
-                        "error": "Max iterations reached",
-                        "cached": False
-                    })
-                    failed += 1
-                    
-            except Exception as e:
-                logger.error(f"Error processing batch query {idx + 1}: {e}")
-                results.append({
+                results[idx] = {
                     "query_index": idx + 1,
                     "query": user_query,
-                    "error": str(e),
+                    "response": outcome["response"],
+                    "tool_uses": outcome["tool_uses"],
+                    "iterations": outcome["iterations"],
                     "cached": False
-                })
-                failed += 1
+                }
+                successful += 1
         
         end_time = datetime.now()
         total_time = (end_time - start_time).total_seconds()
@@ -899,6 +1641,8 @@ def health():
 @app.route('/api/cache/stats', methods=['GET'])
 def cache_stats():
     """Get cache statistics."""
+    cache_hits = CACHE_HITS.value
+    cache_misses = CACHE_MISSES.value
     total_requests = cache_hits + cache_misses
     hit_rate = cache_hits / total_requests if total_requests > 0 else 0
     
@@ -913,6 +1657,7 @@ def cache_stats():
         "cache_ttl_hours": CACHE_TTL.total_seconds() / 3600,
         "cache_hits": cache_hits,
         "cache_misses": cache_misses,
+        "semantic_cache_enabled": SEMANTIC_CACHE_ENABLED and embedding_model is not None,
         "total_requests": total_requests,
         "hit_rate": round(hit_rate, 3),
         "estimated_savings_usd": round(estimated_savings, 2)
@@ -922,18 +1667,35 @@ def cache_stats():
 @app.route('/api/cache/clear', methods=['POST'])
 def clear_cache():
     """Clear all cached responses."""
-    global QUERY_CACHE, cache_hits, cache_misses
+    global QUERY_CACHE, CACHE_EMBEDDINGS, CACHE_EMBEDDING_KEYS
+    
+    # Empty the store first (after any writes already queued), so nothing cleared
+    # below can be rehydrated from it
+    if cache_db is not None:
+        CACHE_DB_QUEUE.put(("DELETE FROM query_cache", ()))
+        if not flush_cache_db_writer():
+            with CACHE_DB_LOCK:
+                cache_db.execute("DELETE FROM query_cache")
+                cache_db.commit()
+    
+    # Swap in empty containers under the lock; the old ones are counted and freed outside it
+    with CACHE_LOCK:
+        old_cache = QUERY_CACHE
+        QUERY_CACHE = OrderedDict()
+        CACHE_EMBEDDINGS = None
+        CACHE_EMBEDDING_KEYS = []
     
-    cache_size_before = len(QUERY_CACHE)
-    QUERY_CACHE.clear()
+    cache_size_before = len(old_cache)
+    if cache_size_before == 0:
+        return "", 204
     
     logger.info(f"Cache cleared: {cache_size_before} entries removed")
     
     return jsonify({
         "status": "cache cleared",
         "entries_removed": cache_size_before,
-        "cache_hits_reset": cache_hits,
-        "cache_misses_reset": cache_misses
+        "cache_hits_reset": CACHE_HITS.value,
+        "cache_misses_reset": CACHE_MISSES.value
     })
 
 
@@ -944,7 +1706,8 @@ def clear_conversation_endpoint():
     session_id = data.get('session_id')
     
     if session_id:
-        clear_conversation(session_id)
+        if not clear_conversation(session_id):
+            return "", 204
         return jsonify({
             "status": "conversation cleared",
             "session_id": session_id
@@ -966,8 +1729,8 @@ def submit_feedback():
         if not data.get('helpfulness_explanation'):
             return jsonify({"error": "Helpfulness explanation is required"}), 400
         
-        # Log to Google Sheets
-        log_feedback_to_sheets({
+        # Log to Google Sheets in the background
+        SHEETS_FEEDBACK_POOL.submit(log_feedback_to_sheets, {
             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'session_id': data.get('session_id', ''),
             'query': data.get('query', ''),
@@ -1125,43 +1888,9 @@ Keep the total response under 400 words. Use markdown formatting (headers, bold,
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/transcript/analyze', methods=['POST'])
-def analyze_transcript():
-    """Analyze transcript for course import eligibility."""
-    if not client:
-        return jsonify({"error": "Anthropic API key not configured"}), 500
-    
-    try:
-        import base64
-        
-        transcript_text = None
-        transcript_files = []
-        
-        # Check if file upload or text input
-        if 'files' in request.files:
-            # Handle multiple files
-            files = request.files.getlist('files')
-            if not files or files[0].filename == '':
-                return jsonify({"error": "No files selected"}), 400
-            
-            for file in files:
-                file_content = file.read()
-                transcript_files.append({
-                    'data': base64.b64encode(file_content).decode(),
-                    'type': file.content_type or 'image/jpeg',
-                    'name': file.filename
-                })
-            
-            logger.info(f"Analyzing {len(transcript_files)} file(s): {', '.join([f['name'] for f in transcript_files])}")
-            
-        elif request.json and 'text' in request.json:
-            transcript_text = request.json['text']
-            logger.info(f"Analyzing text ({len(transcript_text)} chars)")
-        else:
-            return jsonify({"error": "Provide 'file' or 'text'"}), 400
-        
-        # Analysis prompt with comprehensive import rules
-        prompt = """Analyze for Columbia CS PhD course import eligibility.
+# Transcript analysis prompt with comprehensive import rules; sent as a cached
+# system prefix so only the transcript itself changes between calls
+TRANSCRIPT_PROMPT = """Analyze for Columbia CS PhD course import eligibility.
 
 COMPLETE IMPORT RULES:
 1. Grade B+ or better (REQUIRED)
@@ -1223,48 +1952,226 @@ OUTPUT JSON FORMAT:
 }
 
 CRITICAL: Always include the detailed next_steps message explaining the admin approval process and clarifying that Columbia equivalents don't automatically disqualify."""
+
+TRANSCRIPT_SYSTEM_BLOCKS = [{"type": "text", "text": TRANSCRIPT_PROMPT, "cache_control": {"type": "ephemeral"}}]
+TRANSCRIPT_PAGES_BLOCK = {"type": "text", "text": "Analyze the transcript pages above."}
+TRANSCRIPT_LABEL_BLOCK = {"type": "text", "text": "TRANSCRIPT:"}
+
+# Upload limits, checked before any file bytes are read
+MAX_TRANSCRIPT_BYTES = 25 * 1024 * 1024  # Whole request body
+MAX_TRANSCRIPT_FILES = 10
+TRANSCRIPT_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp"})
+
+
+def hash_transcript_file(file) -> dict:
+    """Hash one uploaded transcript file chunk by chunk (runs on UPLOAD_POOL)."""
+    hasher = xxhash.xxh3_128()
+    stream = file.stream
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+        hasher.update(chunk)
+    stream.seek(0)
+    return {
+        'stream': stream,
+        'type': file.content_type or 'image/jpeg',
+        'name': file.filename,
+        'digest': hasher.hexdigest()
+    }
+
+
+def upload_transcript_file(file) -> str:
+    """Upload one transcript file's raw bytes to the Files API (runs on UPLOAD_POOL)."""
+    uploaded = client.beta.files.upload(
+        file=(file['name'], file['stream'], file['type']),
+        betas=[FILES_API_BETA]
+    )
+    return uploaded.id
+
+
+def delete_uploaded_files(uploads):
+    """Delete the files a request uploaded once the analysis is done."""
+    for upload in uploads:
+        if upload.exception() is not None:
+            continue
+        try:
+            client.beta.files.delete(upload.result(), betas=[FILES_API_BETA])
+        except Exception as e:
+            logger.warning(f"Failed to delete uploaded file {upload.result()}: {e}")
+
+
+def transcript_cache_key(transcript_files, transcript_text) -> tuple:
+    """QUERY_CACHE key for a transcript, namespaced away from query keys."""
+    if transcript_files:
+        return ('transcript', tuple(file['digest'] for file in transcript_files))
+    return ('transcript', xxhash.xxh3_128_hexdigest(transcript_text.encode()))
+
+
+def get_cached_analysis(key):
+    """Return a cached transcript analysis if it is still valid."""
+    if not CACHE_ENABLED:
+        return None
+    
+    with CACHE_LOCK:
+        cached = QUERY_CACHE.get(key)
+        if cached is not None:
+            if time.time() - cached['timestamp'] < CACHE_TTL_SECONDS:
+                QUERY_CACHE.move_to_end(key)
+                CACHE_HITS.increment()
+                logger.info(f"  ✓ Cache HIT - returning cached transcript analysis")
+                return cached['analysis']
+            del QUERY_CACHE[key]
+    
+    CACHE_MISSES.increment()
+    return None
+
+
+def cache_analysis(key, analysis):
+    """Cache a parsed transcript analysis alongside the query cache entries."""
+    if not CACHE_ENABLED:
+        return
+    
+    with CACHE_LOCK:
+        QUERY_CACHE[key] = {'analysis': analysis, 'timestamp': time.time()}
+        QUERY_CACHE.move_to_end(key)
+        evict_lru_entries()
+
+
+ANALYSIS_HEADER = "ANALYSIS RESULTS\n" + "=" * 50 + "\n\n"
+COURSE_BLOCK_FORMAT = "Course %d: %s (%s) - %s\n  Grade: %s, Year: %s, Department: %s\n%s\n"
+
+
+JSON_DECODER = json.JSONDecoder()
+
+
+def read_json_object(text_stream):
+    """
+    Consume streamed text until the first top-level JSON object closes.
+    
+    Tracks brace depth (ignoring braces inside JSON strings) while the chunks
+    arrive. Returns (text read, parsed object or None).
+    """
+    chunks = []
+    offset = 0
+    start = None
+    depth = 0
+    in_string = False
+    escaped = False
+    
+    for text in text_stream:
+        chunks.append(text)
+        for i, ch in enumerate(text):
+            if start is None:
+                if ch == '{':
+                    start = offset + i
+                    depth = 1
+                continue
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    result = "".join(chunks)
+                    try:
+                        # orjson needs the object sliced out but still beats the
+                        # stdlib; without it raw_decode parses in place (no copy)
+                        if orjson:
+                            return result, orjson.loads(result[start:offset + i + 1])
+                        return result, JSON_DECODER.raw_decode(result, start)[0]
+                    except json.JSONDecodeError:  # orjson's error subclasses it
+                        # Not valid JSON after all; read the rest and give up parsing
+                        return result + "".join(text_stream), None
+        offset += len(text)
+    
+    return "".join(chunks), None
+
+
+def analyze_transcript():
+    """Analyze transcript for course import eligibility."""
+    try:
+        transcript_text = None
+        transcript_files = []
         
-        # Build message
-        if transcript_files:
-            # Add all images to content
-            content = []
-            for file in transcript_files:
-                content.append({
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": file['type'],
-                        "data": file['data']
-                    }
-                })
-            # Add prompt text after all images
-            content.append({"type": "text", "text": prompt})
-        else:
-            content = f"{prompt}\n\nTRANSCRIPT:\n{transcript_text}"
+        # Enforced while the body is read, so chunked uploads without a
+        # Content-Length are capped too (raises RequestEntityTooLarge)
+        request.max_content_length = MAX_TRANSCRIPT_BYTES
         
-        # Call Claude
-        response = client.messages.create(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=4096,
-            temperature=0,
-            messages=[{"role": "user", "content": content}]
-        )
+        # Check if file upload or text input
+        if 'files' in request.files:
+            # Handle multiple files
+            files = request.files.getlist('files')
+            if not files or files[0].filename == '':
+                return jsonify({"error": "No files selected"}), 400
+            
+            if len(files) > MAX_TRANSCRIPT_FILES:
+                return jsonify({"error": f"Too many files (max {MAX_TRANSCRIPT_FILES})"}), 400
+            
+            for file in files:
+                if (file.content_type or 'image/jpeg') not in TRANSCRIPT_CONTENT_TYPES:
+                    return jsonify({"error": f"Unsupported file type: {file.content_type}"}), 415
+            
+            # Hash the files in parallel (for the cache key); map keeps upload order
+            transcript_files = list(UPLOAD_POOL.map(hash_transcript_file, files))
+            
+            # The file list is only joined if INFO logging is on
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Analyzing %d file(s): %s", len(transcript_files), ', '.join(f['name'] for f in transcript_files))
+            
+        elif request.json and 'text' in request.json:
+            transcript_text = request.json['text']
+            logger.info("Analyzing text (%d chars)", len(transcript_text))
+        else:
+            return jsonify({"error": "Provide 'file' or 'text'"}), 400
         
-        result = ""
-        for block in response.content:
-            if hasattr(block, "text"):
-                result += block.text
+        # Identical transcripts (re-uploads, retries) produce identical analyses
+        cache_key = transcript_cache_key(transcript_files, transcript_text)
+        analysis = get_cached_analysis(cache_key)
+        cached = analysis is not None
         
-        # Parse JSON
-        try:
-            json_start = result.find('{')
-            json_end = result.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                analysis = json.loads(result[json_start:json_end])
-            else:
+        if cached:
+            result = analysis.get('raw', '')
+        else:
+            # Upload the files' raw bytes in parallel instead of base64-encoding them
+            uploads = [UPLOAD_POOL.submit(upload_transcript_file, file) for file in transcript_files]
+            try:
+                # Build message (the import rules are in the cached system prompt)
+                if uploads:
+                    content = [
+                        {"type": "image", "source": {"type": "file", "file_id": upload.result()}}
+                        for upload in uploads
+                    ]
+                    content.append(TRANSCRIPT_PAGES_BLOCK)
+                else:
+                    # Label and transcript go in separate blocks, so the text is never copied
+                    content = [TRANSCRIPT_LABEL_BLOCK, {"type": "text", "text": transcript_text}]
+                
+                # Stream Claude's answer and parse the JSON as soon as it is complete;
+                # leaving the stream early stops the generation of any trailing text
+                with client.beta.messages.stream(
+                    model="claude-sonnet-4-5-20250929",
+                    max_tokens=4096,
+                    temperature=0,
+                    system=TRANSCRIPT_SYSTEM_BLOCKS,
+                    messages=[{"role": "user", "content": content}],
+                    betas=[FILES_API_BETA]
+                ) as stream:
+                    result, analysis = read_json_object(stream.text_stream)
+            finally:
+                if uploads:
+                    UPLOAD_POOL.submit(delete_uploaded_files, uploads)
+            
+            if analysis is None:
                 analysis = {"raw": result}
-        except:
-            analysis = {"raw": result}
+            else:
+                cache_analysis(cache_key, analysis)
         
         # Log to Google Sheets
         try:
@@ -1273,42 +2180,54 @@ CRITICAL: Always include the detailed next_steps message explaining the admin ap
             
             # Format response as readable text
             if analysis.get('courses'):
-                formatted_response = "ANALYSIS RESULTS\n" + "="*50 + "\n\n"
+                parts = [ANALYSIS_HEADER]
                 
+                # One formatted block per course keeps the number of small strings down
                 for i, course in enumerate(analysis['courses'], 1):
-                    status = "✓ ELIGIBLE" if course.get('eligible') else "✗ INELIGIBLE"
-                    formatted_response += f"Course {i}: {course.get('name', 'Unknown')} ({course.get('number', 'N/A')}) - {status}\n"
-                    formatted_response += f"  Grade: {course.get('grade', 'N/A')}, Year: {course.get('year', 'N/A')}, Department: {course.get('department', 'N/A')}\n"
-                    
-                    if course.get('reasoning'):
-                        formatted_response += f"  Reason: {course.get('reasoning')}\n"
-                    elif course.get('ineligible_reasons'):
-                        formatted_response += f"  Issues: {', '.join(course.get('ineligible_reasons'))}\n"
-                    
-                    formatted_response += "\n"
+                    get = course.get
+                    status = "✓ ELIGIBLE" if get('eligible') else "✗ INELIGIBLE"
+                    reasoning = get('reasoning')
+                    reasons = get('ineligible_reasons')
+                    if reasoning:
+                        detail = "  Reason: %s\n" % reasoning
+                    elif reasons:
+                        detail = "  Issues: %s\n" % ', '.join(reasons)
+                    else:
+                        detail = ""
+                    parts.append(COURSE_BLOCK_FORMAT % (
+                        i, get('name', 'Unknown'), get('number', 'N/A'), status,
+                        get('grade', 'N/A'), get('year', 'N/A'), get('department', 'N/A'),
+                        detail))
                 
                 # Add summary
                 if analysis.get('summary'):
                     summary = analysis['summary']
-                    formatted_response += f"\nSUMMARY: {summary.get('eligible', 0)} out of {summary.get('total', 0)} courses eligible for import\n"
+                    parts.append(f"\nSUMMARY: {summary.get('eligible', 0)} out of {summary.get('total', 0)} courses eligible for import\n")
                 
-                response_text = formatted_response
+                response_text = "".join(parts)
             else:
                 # Fallback to raw result
                 response_text = result[:1000]
             
             log_to_sheets('transcript', query_text[:5000], response_text[:5000],
-                         [{'name': 'transcript_analyzer'}], 1, False)
+                         [{'name': 'transcript_analyzer'}], 1, cached)
         except Exception as e:
             logger.warning(f"Failed to log transcript analysis to sheets: {e}")
         
         return jsonify(analysis)
         
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Request too large (max {MAX_TRANSCRIPT_BYTES // (1024 * 1024)}MB)"}), 413
     except Exception as e:
         logger.error(f"Transcript analysis error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
+# The client is created at import, so pick the handler once instead of checking per request
+app.add_url_rule('/api/transcript/analyze', endpoint='analyze_transcript', methods=['POST'],
+                 view_func=analyze_transcript if CLIENT_READY else client_not_configured)
+
+
 if __name__ == '__main__':
     # Check for API key
     if not os.environ.get("ANTHROPIC_API_KEY"):
@@ -1333,6 +2252,9 @@ if __name__ == '__main__':
         print("✗ MCP server failed to initialize")
         print("  Check that documents/ folder exists with policy files")
     
+    # Expire idle conversations in the background
+    start_conversation_reaper()
+    
     # Initialize Google Sheets logging
     print("Initializing Google Sheets logging...")
     if init_google_sheets():
@@ -1340,8 +2262,23 @@ if __name__ == '__main__':
     else:
         print("✗ Google Sheets logging disabled")
     
+    # Load the embedding model for the semantic cache
+    print("Initializing semantic cache...")
+    if init_semantic_cache():
+        print("✓ Semantic cache ready")
+    else:
+        print("✗ Semantic cache disabled")
+    
+    # Open the persistent cache store (after the semantic cache so loaded entries get embeddings)
+    print("Initializing cache store...")
+    if init_cache_store():
+        print(f"✓ Cache store ready ({len(QUERY_CACHE)} cached queries)")
+    else:
+        print("✗ Cache store disabled")
+    
     print(f"Open your browser to: http://localhost:5000")
     print("Press Ctrl+C to stop the server")
     print("="*60 + "\n")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Debug mode comes from FLASK_DEBUG
+    app.run(host='0.0.0.0', port=5000)